@@ -3,7 +3,11 @@ import itertools
 import unittest
 
 import numpy as np
-from tuhlbox.life import LifeVectorizer
+from tuhlbox.life import (
+    LifeVectorizer,
+    get_features_for_nested_samples,
+    get_features_for_sample,
+)
 
 
 class TestLife(unittest.TestCase):
@@ -239,3 +243,60 @@ class TestLife(unittest.TestCase):
         self.assertTrue(freq_4_count <= frag_size / 2)
         #  no sample should have word occurring more often than twice
         self.assertAlmostEqual(freq_10_count, 0.0)
+
+    def test_nested_sample_features(self) -> None:
+        """Count prefixes incrementally like separately counted samples."""
+        sample = [str(x) for x in np.random.randint(0, 20, size=300)]
+        sizes = [1, 5, 40, 41, 200, 300]
+        actual = get_features_for_nested_samples(sample, sizes)
+        expected = [get_features_for_sample(sample[:size]) for size in sizes]
+        self.assertEqual(actual, expected)
+
+    def test_nested_samples_double_bfs(self) -> None:
+        """Use two unsorted window sizes with BOTH and nested samples."""
+        text = [str(x) for x in range(100)]
+        transformer = LifeVectorizer([42, 17], 20, "both", nested_samples=True)
+        actual = transformer.transform([text])[0].tolist()
+        predicted = [42.0, 42.0] + [0.0] * 6
+        predicted += predicted
+        predicted += [17.0, 17.0] + [0.0] * 6 + [17.0, 17.0] + [0.0] * 6
+        self.assertEqual(actual, predicted)
+
+    def test_nested_samples_short_document(self) -> None:
+        """Use nested samples with sizes larger than the text."""
+        text = [str(x) for x in range(100)]
+        transformer = LifeVectorizer([1000, 50], 3, "fragment", nested_samples=True)
+        actual = transformer.transform([text])[0].tolist()
+        predicted = [100.0, 100.0] + [0.0] * 6 + [50.0, 50.0] + [0.0] * 6
+        self.assertEqual(actual, predicted)
+        transformer = LifeVectorizer([1000], 1, "bow", force=False, nested_samples=True)
+        self.assertRaises(ValueError, transformer.transform, [text])
+
+    def test_nested_samples_fragment_independent(self) -> None:
+        """Draw fragment windows of smaller sizes anywhere in the text."""
+        text = [str(x) for x in range(50)] + ["x"] * 50
+        transformer = LifeVectorizer([100, 10], 200, "fragment", nested_samples=True)
+        actual = transformer.transform([text])[0]
+        # with prefixes of the whole text, every window of 10 had 10 types
+        self.assertLess(actual[8], 10.0)
+        self.assertNotEqual(actual[12], 0.0)
+
+    def test_output_dtype(self) -> None:
+        """Return a preallocated matrix of the requested type."""
+        text = [[str(x) for x in range(100)]] * 3
+        transformer = LifeVectorizer([10, 20], 2, "both")
+        actual = transformer.transform(text)
+        self.assertEqual(actual.shape, (3, 32))
+        self.assertEqual(actual.dtype, np.float32)
+        transformer = LifeVectorizer([10, 20], 2, "both", dtype=np.float64)
+        self.assertEqual(transformer.transform(iter(text)).dtype, np.float64)
+
+    def test_transform_chunks(self) -> None:
+        """Yield the same features as transform in fixed-size chunks."""
+        texts = [[str(x) for x in range(100)] for _ in range(7)]
+        transformer = LifeVectorizer([42, 10], 5, "fragment")
+        chunks = list(transformer.transform_chunks(iter(texts), chunk_size=3))
+        self.assertEqual([c.shape for c in chunks], [(3, 16), (3, 16), (1, 16)])
+        expected = transformer.transform(texts)
+        np.testing.assert_array_equal(np.concatenate(chunks), expected)
+        self.assertRaises(ValueError, next, transformer.transform_chunks(texts, 0))
@@ -1,5 +1,26 @@
+import gc
+import pickle
+import weakref
+from pathlib import Path
 from typing import List
-from tuhlbox.stanza import StanzaNlpToFieldTransformer, StanzaParserTransformer
+
+from sklearn.base import clone
+from sklearn.pipeline import make_pipeline
+from tuhlbox.stanza import (
+    PIPELINES,
+    ColumnarDocument,
+    ParseCache,
+    StanzaNlpToFieldTransformer,
+    StanzaParserTransformer,
+    StanzaToNltkTreesTransformer,
+    StanzaWordFeatureFrequencyTransformer,
+    WordTable,
+    get_pipeline,
+    load_document,
+    processors_for_fields,
+    resolve_processors,
+    save_document,
+)
 
 sentences: List
 
@@ -54,3 +75,191 @@ def test_stanza_nlp_to_field_transformer_upos() -> None:
     ]
     actual = transformer.transform(sentences)
     assert expected == actual
+
+
+def test_stanza_to_nltk_trees_transformer() -> None:
+    transformer = StanzaToNltkTreesTransformer(["upos", "dependency"])
+    actual = transformer.transform(sentences)
+    assert [len(document) for document in actual] == [2, 1]
+    for document, trees in zip(sentences, actual):
+        for sentence, tree in zip(document.sentences, trees):
+            # every word is part of the tree exactly once
+            assert len(tree.treepositions()) == len(sentence.words) + 1
+            assert tree == transformer.get_symbols(transformer.parse(sentence))
+    assert actual[1][0].label() == "root"
+    assert actual[1][0][0].label() == "root#NOUN"
+
+
+def test_stanza_parser_transformer_batches() -> None:
+    documents = [sentence.text for sentence in sentences]
+    parser = StanzaParserTransformer("en", silent=True, batch_size=1)
+    transformer = StanzaNlpToFieldTransformer("xpos")
+    expected = transformer.transform(sentences)
+    assert transformer.transform(parser.transform(documents)) == expected
+
+
+def test_stanza_parser_transformer_shares_pipeline() -> None:
+    parser = StanzaParserTransformer("en", silent=True)
+    assert clone(parser).nlp is parser.nlp
+    assert parser.nlp is get_pipeline("en", use_gpu=True)
+    assert PIPELINES.nbytes > 0
+    # the model weights are not part of the pickled transformer
+    assert len(pickle.dumps(parser)) < 10000
+    assert pickle.loads(pickle.dumps(parser)).nlp is parser.nlp
+
+
+def test_stanza_parser_transformer_jobs() -> None:
+    documents = [sentence.text for sentence in sentences]
+    parser = StanzaParserTransformer("en", silent=True, batch_size=1, n_jobs=2)
+    transformer = StanzaNlpToFieldTransformer("xpos")
+    expected = transformer.transform(sentences)
+    assert transformer.transform(parser.transform(documents)) == expected
+
+
+def test_stanza_parser_transformer_cache(tmp_path: Path) -> None:
+    documents = [sentences[1].text, sentences[0].text, sentences[1].text]
+    parser = StanzaParserTransformer("en", silent=True, cache_dir=str(tmp_path))
+    transformer = StanzaNlpToFieldTransformer("upos")
+    first = transformer.transform(parser.transform(documents))
+    assert first[0] == first[2]
+    cache = ParseCache(str(tmp_path))
+    assert cache.get(documents[0], "en") is not None
+    assert cache.get(documents[0], "de") is None
+    assert transformer.transform(parser.transform(documents)) == first
+
+
+def test_word_table() -> None:
+    document = sentences[0]
+    table = WordTable.of(document)
+    assert WordTable.of(document) is table
+    assert table.num_sentences == 2
+    words = [word for sentence in document.sentences for word in sentence.words]
+    assert len(table) == len(words)
+    assert table.strings("upos") == [word.upos for word in words]
+    assert table.strings("xpos", positions=table.sentence(1)) == [
+        word.xpos for word in document.sentences[1].words
+    ]
+    assert table.head.tolist() == [word.head for word in words]
+    # "I" is a singular pronoun, but "." has no number
+    assert table.strings("Number")[0] == "Sing"
+    assert table.strings("Number")[-1] == "_"
+    # the cached table doesn't keep its document alive
+    reference = weakref.ref(document)
+    del document, words, sentences[0]
+    gc.collect()
+    assert reference() is None
+
+
+def test_stanza_nlp_to_field_transformer_fields() -> None:
+    fields = ["upos", "xpos", "lemma"]
+    actual = StanzaNlpToFieldTransformer(fields).transform(sentences)
+    assert list(actual.keys()) == fields
+    for field in fields:
+        assert actual[field] == StanzaNlpToFieldTransformer(field).transform(sentences)
+    transformer = StanzaNlpToFieldTransformer(fields, output="ids")
+    ids = transformer.fit_transform(sentences)
+    for field in fields:
+        labels = sorted(
+            transformer.vocabulary_[field], key=transformer.vocabulary_[field].get
+        )
+        decoded = [
+            [[labels[i] for i in sentence.tolist()] for sentence in document]
+            for document in ids[field]
+        ]
+        assert decoded == actual[field]
+    # the ids are stored on the estimator, labels not seen during fit are -1
+    restored = pickle.loads(pickle.dumps(transformer))
+    expected = [sentence.tolist() for sentence in ids["upos"][1]]
+    actual_ids = restored.transform(sentences[1:])["upos"][0]
+    assert [sentence.tolist() for sentence in actual_ids] == expected
+    unseen = StanzaNlpToFieldTransformer("lemma", output="ids").fit([])
+    assert set(unseen.transform(sentences)[0][0].tolist()) == {-1}
+
+
+def test_stanza_word_feature_frequency_transformer(tmp_path: Path) -> None:
+    seed = tmp_path / "features.json"
+    seed.write_text('["Foo__Bar"]')
+    transformer = StanzaWordFeatureFrequencyTransformer(str(seed))
+    actual = transformer.fit_transform(sentences)
+    names = transformer.get_feature_names()
+    assert names[0] == "Foo__Bar"
+    assert names[-1] == "UNK"
+    assert actual.shape == (2, len(names))
+    words = [word for sentence in sentences[1].sentences for word in sentence.words]
+    singular = sum("Number=Sing" in (word.feats or "") for word in words)
+    assert actual[1, names.index("Number__Sing")] == singular
+    assert actual[:, [0, -1]].sum() == 0
+
+
+def test_columnar_document(tmp_path: Path) -> None:
+    path = str(tmp_path / "document.npz")
+    save_document(sentences[0], path)
+    for document in [load_document(path), ColumnarDocument.load(path, mmap=False)]:
+        assert isinstance(document, ColumnarDocument)
+        assert document.text == sentences[0].text
+        assert document.num_words == sentences[0].num_words
+        assert document.num_tokens == sentences[0].num_tokens
+        assert document.sentence_texts == [
+            sentence.text for sentence in sentences[0].sentences
+        ]
+        for field in ["upos", "lemma", "Number", "feats", "head", "id"]:
+            transformer = StanzaNlpToFieldTransformer(field)
+            assert transformer.transform([document]) == transformer.transform(
+                sentences[:1]
+            )
+        transformer = StanzaToNltkTreesTransformer(["upos", "dependency"])
+        assert transformer.transform([document]) == transformer.transform(sentences[:1])
+
+
+def test_load_many_columnar_documents(tmp_path: Path) -> None:
+    path = str(tmp_path / "document.npz")
+    save_document(sentences[0], path)
+    documents = [load_document(path) for _ in range(3000)]
+    assert all(document.num_words == sentences[0].num_words for document in documents)
+    mapped = [ColumnarDocument.load(path, mmap=True) for _ in range(100)]
+    assert all(document.text == sentences[0].text for document in mapped)
+
+
+def test_auto_processors() -> None:
+    assert processors_for_fields(["upos", "Number"]) == "tokenize,pos"
+    assert processors_for_fields(["dependency"]) == "tokenize,pos,lemma,depparse"
+    pipeline = make_pipeline(
+        StanzaParserTransformer("en", silent=True, processors="auto"),
+        StanzaNlpToFieldTransformer("upos"),
+    )
+    resolve_processors(pipeline)
+    assert pipeline.steps[0][1].processors == "tokenize,pos"
+    documents = [sentence.text for sentence in sentences]
+    expected = StanzaNlpToFieldTransformer("upos").transform(sentences)
+    assert pipeline.transform(documents) == expected
+
+
+def test_token_budget(tmp_path: Path) -> None:
+    documents = [sentence.text for sentence in sentences]
+    parser = StanzaParserTransformer("en", silent=True, processors="tokenize,pos")
+    bucketed = StanzaParserTransformer(
+        "en", silent=True, processors="tokenize,pos", token_budget=16
+    )
+    transformer = StanzaNlpToFieldTransformer(["upos", "xpos"])
+    expected = parser.transform(documents)
+    actual = bucketed.transform(documents)
+    assert transformer.transform(actual) == transformer.transform(expected)
+    for expected_document, document in zip(expected, actual):
+        assert document.text == expected_document.text
+        assert [sentence.text for sentence in document.sentences] == [
+            sentence.text for sentence in expected_document.sentences
+        ]
+        assert [
+            (token.text, token.start_char, token.end_char)
+            for sentence in document.sentences
+            for token in sentence.tokens
+        ] == [
+            (token.text, token.start_char, token.end_char)
+            for sentence in expected_document.sentences
+            for token in sentence.tokens
+        ]
+    # bucketed parses are cached separately
+    cache = ParseCache(str(tmp_path))
+    cache.put(documents[0], "en", "tokenize,pos", actual[0], bucketed=True)
+    assert cache.get(documents[0], "en", "tokenize,pos") is None
+    assert cache.get(documents[0], "en", "tokenize,pos", bucketed=True) is not None
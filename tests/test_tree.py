@@ -1,13 +1,89 @@
 """Tests tree-based models."""
+
+import itertools
+import random
 import unittest
+from collections import Counter
+from types import SimpleNamespace
+from typing import List
 
 import nltk
+import numpy as np
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.pipeline import make_pipeline, make_union
+from tuhlbox.stringkernels import pqgram_kernel
 from tuhlbox.tree import (
+    ArrayTree,
+    LabelTable,
+    PqGramTransformer,
     StringToTreeTransformer,
     TreeChainTransformer,
+    TreeMultiViewTransformer,
+    TreeStatsVectorizer,
+    TreeToFlatStringTransformer,
+    TreeToStringTransformer,
+    TreeViewSelector,
     WordToPosTransformer,
+    parse_bracketed_tree,
 )
 
+TREE_STRINGS = [
+    "(S (DP (D the) (NP dog)) (VP (V chased) (DP (D the) (NP cat))))",
+    "(S (NP I) (VP (V saw) (NP him)))",
+    "(ROOT (S (NP (PRP I)) (VP (VBD went) (PP (IN to) (NP (NN school)))) (. .)))",
+    "(S a b (X))",
+]
+
+
+def _random_tree(depth: int) -> nltk.Tree:
+    labels = ["A", "B", "C"]
+    if depth == 0 or random.random() < 0.2:
+        return nltk.Tree(random.choice(labels), ["x"] * random.randint(0, 2))
+    children = [_random_tree(depth - 1) for _ in range(random.randint(1, 3))]
+    return nltk.Tree(random.choice(labels), children)
+
+
+def _find_chains_recursive(
+    tree: nltk.Tree, prev_labels: List[str], max_length: int
+) -> List[List[str]]:
+    """Reference implementation of TreeChainTransformer._find_chains."""
+    ret_full = []
+    if isinstance(tree, str) or len(tree) == 0:
+        if not max_length or len(prev_labels) < max_length:
+            ret_full.append(prev_labels[:])
+        return ret_full
+    if max_length and len(prev_labels) == max_length:
+        prev_labels = prev_labels[1:]
+    prev_labels.append(tree.label())
+    if len(prev_labels) == max_length:
+        ret_full.append(prev_labels[:])
+    for child in tree:
+        ret_full += _find_chains_recursive(child, prev_labels[:], max_length)
+    return ret_full
+
+
+def _pqgrams_recursive(tree: nltk.Tree, p: int, q: int) -> List[str]:
+    """Compute pq-grams with the recursive algorithm of Augsten et al. 2010."""
+    result: List[str] = []
+
+    def visit(node: nltk.Tree, stem: List[str]) -> None:
+        label = node.label() if isinstance(node, nltk.Tree) else node
+        stem = stem[1:] + [label]
+        base = ["*"] * q
+        children = list(node) if isinstance(node, nltk.Tree) else []
+        if not children:
+            result.append("-".join(stem + base))
+        for child in children:
+            base = base[1:] + [child.label() if isinstance(child, nltk.Tree) else child]
+            result.append("-".join(stem + base))
+            visit(child, stem)
+        for _ in range(q - 1 if children else 0):
+            base = base[1:] + ["*"]
+            result.append("-".join(stem + base))
+
+    visit(tree, ["*"] * p)
+    return result
+
 
 class TestTrees(unittest.TestCase):
     """Tests tree-based models."""
@@ -22,6 +98,20 @@ class TestTrees(unittest.TestCase):
         actual = transformer.transform(documents)
         self.assertEqual(actual, expected)
 
+    def test_bracketed_parsing(self) -> None:
+        """Test if the tree parser behaves like nltk.Tree.fromstring."""
+        strings = [
+            "(S (NP I) (VP (V saw) (NP him)))",
+            "(S(NP I)(VP(V saw)(NP him)))",
+            "((S (NP I)))",
+            "(S)",
+            "(S a b (X))",
+        ]
+        for string in strings:
+            self.assertEqual(parse_bracketed_tree(string), nltk.Tree.fromstring(string))
+        for string in ["(S a", "(S a))", "(S a) (T b)", "S", ""]:
+            self.assertRaises(ValueError, parse_bracketed_tree, string)
+
     def test_pos_extraction(self) -> None:
         """Test if POS tags are extracted correctly."""
         transformer = WordToPosTransformer()
@@ -222,3 +312,302 @@ class TestTrees(unittest.TestCase):
             "combine_strings": " ",
         }
         self.assertRaises(ValueError, TreeChainTransformer, **kwargs)
+
+    def test_array_tree_conversion(self) -> None:
+        """Test if array trees convert from and to nltk trees."""
+        label_table = LabelTable()
+        for string in TREE_STRINGS + ["(S)", "((S a))"]:
+            tree = nltk.Tree.fromstring(string)
+            array_tree = ArrayTree.fromstring(string, label_table)
+            self.assertEqual(array_tree, ArrayTree.from_nltk(tree))
+            self.assertEqual(array_tree.to_nltk(), tree)
+            self.assertEqual(array_tree.label(), tree.label())
+            self.assertEqual(array_tree.height(), tree.height())
+            self.assertEqual(array_tree.pos(), tree.pos())
+        self.assertEqual(len(label_table), len(set(label_table.labels)))
+        tree = ArrayTree.fromstring("(S (NP I) (VP (V saw) (NP him)))")
+        self.assertEqual(tree.get_children(0).tolist(), [1, 3])
+        self.assertEqual(tree.get_children(3).tolist(), [4, 6])
+        self.assertEqual(tree.get_child_counts().tolist(), [2, 1, 0, 2, 1, 0, 1, 0])
+        self.assertEqual(tree.get_depths().tolist(), [0, 1, 2, 1, 2, 3, 2, 3])
+
+    def test_array_tree_parsing(self) -> None:
+        """Test if strings are parsed into array trees."""
+        transformer = StringToTreeTransformer(output="array")
+        actual = transformer.transform([TREE_STRINGS[:2], TREE_STRINGS[2:]])
+        self.assertEqual([len(document) for document in actual], [2, 2])
+        self.assertIs(actual[0][0].label_table, actual[1][1].label_table)
+        self.assertEqual(actual[1][0].to_nltk(), nltk.Tree.fromstring(TREE_STRINGS[2]))
+        self.assertRaises(ValueError, StringToTreeTransformer, output="json")
+
+    def test_array_tree_transformers(self) -> None:
+        """Test if all transformers treat array trees like nltk trees."""
+        nltk_documents = [[nltk.Tree.fromstring(s) for s in TREE_STRINGS]]
+        array_documents = StringToTreeTransformer("array").transform([TREE_STRINGS])
+        transformers = [
+            WordToPosTransformer(),
+            TreeToStringTransformer(),
+            TreeChainTransformer(),
+            TreeChainTransformer(max_length=1, combine_chain_elements=" "),
+            TreeChainTransformer(max_length=2, combine_chain_elements=" "),
+            TreeChainTransformer(3, " ", "@", "#"),
+        ]
+        for transformer in transformers:
+            self.assertEqual(
+                transformer.transform(array_documents),
+                transformer.transform(nltk_documents),
+            )
+        np.testing.assert_array_equal(
+            TreeStatsVectorizer().transform(array_documents),
+            TreeStatsVectorizer().transform(nltk_documents),
+        )
+        transformer = TreeToFlatStringTransformer()
+        self.assertEqual(
+            transformer.transform(array_documents),
+            transformer.transform(nltk_documents),
+        )
+        documents = [[nltk.Tree("a", [nltk.Tree("b", []), nltk.Tree("c", [])])]]
+        self.assertEqual(transformer.transform(documents), ["a b c"])
+
+    def test_tree_to_string(self) -> None:
+        """Test if serialized trees look like the ones of nltk."""
+        random.seed(7)
+        trees = [nltk.Tree.fromstring(s) for s in TREE_STRINGS]
+        trees += [_random_tree(5) for _ in range(50)]
+        trees.append(nltk.Tree("A", [nltk.Tree("B", []), "x"]))
+        expected = [[tree.pformat(margin=1000000) for tree in trees]]
+        self.assertEqual(TreeToStringTransformer().transform([trees]), expected)
+        arrays = [[ArrayTree.from_nltk(tree) for tree in trees]]
+        self.assertEqual(TreeToStringTransformer().transform(arrays), expected)
+
+    def test_binary_round_trip(self) -> None:
+        """Test if binary trees can be parsed again."""
+        random.seed(3)
+        trees = [nltk.Tree.fromstring(s) for s in TREE_STRINGS]
+        trees += [_random_tree(5) for _ in range(50)]
+        documents = [trees[:20], trees[20:]]
+        binary = TreeToStringTransformer(binary=True).transform(documents)
+        self.assertTrue(all(isinstance(line, bytes) for line in binary[0]))
+        self.assertEqual(StringToTreeTransformer().transform(binary), documents)
+        arrays = StringToTreeTransformer("array").transform(binary)
+        self.assertEqual([[t.to_nltk() for t in d] for d in arrays], documents)
+        self.assertIs(arrays[0][0].label_table, arrays[1][0].label_table)
+        rewritten = TreeToStringTransformer(binary=True).transform(arrays)
+        self.assertEqual(StringToTreeTransformer().transform(rewritten), documents)
+        self.assertRaises(
+            ValueError, StringToTreeTransformer().transform, [[b"XXXX" + binary[0][0]]]
+        )
+
+    def test_chains_like_recursive(self) -> None:
+        """Test if chains are the same as with the former recursive version."""
+        random.seed(42)
+        documents = [[_random_tree(6) for _ in range(3)] for _ in range(5)]
+        joins = [(None, None, None), (" ", None, None), (" ", "@", None)]
+        joins.append((" ", "@", "#"))
+        for max_length, (elements, chains, strings) in itertools.product(
+            [None, 0, 1, 2, 3, 7], joins
+        ):
+            transformer = TreeChainTransformer(max_length, elements, chains, strings)
+            expected = []
+            for document in documents:
+                new_document: List = []
+                for tree in document:
+                    found: List = _find_chains_recursive(tree, [], max_length)
+                    if elements is not None:
+                        found = [elements.join(chain) for chain in found]
+                    if chains is not None:
+                        new_document.append(chains.join(found))
+                    else:
+                        new_document.append(found)
+                if strings is not None:
+                    new_document = strings.join(new_document)
+                expected.append(new_document)
+            self.assertEqual(transformer.transform(documents), expected)
+            arrays = [[ArrayTree.from_nltk(t) for t in doc] for doc in documents]
+            self.assertEqual(transformer.transform(arrays), expected)
+
+    def test_deep_chains(self) -> None:
+        """Test if chains are extracted from trees deeper than the stack."""
+        tree = nltk.Tree("X", ["leaf"])
+        for _ in range(5000):
+            tree = nltk.Tree("X", [tree])
+        transformer = TreeChainTransformer(max_length=3, combine_chain_elements=" ")
+        actual = transformer.transform([[tree]])
+        self.assertEqual(actual, [[["X X X"] * 4999]])
+
+    def test_hashed_chains(self) -> None:
+        """Test if hashed chains are counted in a sparse matrix."""
+        documents = [
+            [nltk.Tree.fromstring(TREE_STRINGS[0])],
+            [nltk.Tree.fromstring(TREE_STRINGS[1])] * 2,
+        ]
+        transformer = TreeChainTransformer(max_length=2, n_features=2**20)
+        actual = transformer.transform(documents)
+        self.assertEqual(actual.shape, (2, 2**20))
+        # S DP, DP D (2), DP NP (2), S VP, VP V, VP DP
+        self.assertEqual(sorted(actual[0].data.tolist()), [1, 1, 1, 1, 2, 2])
+        # S NP, S VP, VP V, VP NP, for both trees
+        self.assertEqual(actual[1].data.tolist(), [2, 2, 2, 2])
+        # S VP and VP V are shared by both documents
+        shared = set(actual[0].indices) & set(actual[1].indices)
+        self.assertEqual(len(shared), 2)
+        arrays = [[ArrayTree.from_nltk(t) for t in doc] for doc in documents]
+        self.assertEqual((transformer.transform(arrays) != actual).nnz, 0)
+        small = TreeChainTransformer(max_length=2, n_features=3).transform(documents)
+        self.assertEqual(small.sum(axis=1).tolist(), [[8], [8]])
+        kwargs = {"combine_chain_elements": " ", "n_features": 10}
+        self.assertRaises(ValueError, TreeChainTransformer, **kwargs)
+        self.assertRaises(ValueError, TreeChainTransformer, n_features=0)
+
+    def test_counted_chains(self) -> None:
+        """Test if chains are aggregated per document."""
+        documents = [
+            [nltk.Tree.fromstring(TREE_STRINGS[0])],
+            [nltk.Tree.fromstring(TREE_STRINGS[1])] * 2,
+        ]
+        transformer = TreeChainTransformer(max_length=2, count_chains=True)
+        actual = transformer.transform(documents)
+        self.assertEqual(actual[0][("DP", "D")], 2)
+        self.assertEqual(actual[0][("S", "DP")], 1)
+        self.assertEqual(
+            actual[1],
+            {("S", "NP"): 2, ("S", "VP"): 2, ("VP", "V"): 2, ("VP", "NP"): 2},
+        )
+        transformer = TreeChainTransformer(
+            combine_chain_elements=" ", count_chains=True
+        )
+        actual = transformer.transform(documents)
+        self.assertEqual(actual[1], {"S NP": 2, "S VP V": 2, "S VP NP": 2})
+        kwargs = {"combine_chain_elements": " ", "combine_chains": "@"}
+        self.assertRaises(ValueError, TreeChainTransformer, count_chains=True, **kwargs)
+
+    def test_tree_stats(self) -> None:
+        """Test if tree statistics are calculated correctly."""
+        trees = [nltk.Tree.fromstring(string) for string in TREE_STRINGS]
+        documents = [trees[:2], trees[2:], [nltk.Tree("X", [])]]
+        actual = TreeStatsVectorizer().transform(documents)
+        self.assertEqual(actual.shape, (3, 4))
+        for document, row in zip(documents, actual):
+            positions = [len(tree.treepositions()) for tree in document]
+            num_leaves = [len(tree.leaves()) for tree in document]
+            expected = [
+                np.mean([tree.height() for tree in document]),
+                (sum(positions) - len(positions)) / sum(positions),
+                np.mean([n / max(p - 1, 1) for n, p in zip(num_leaves, positions)]),
+                np.mean([max(map(len, tree.subtrees())) for tree in document]),
+            ]
+            np.testing.assert_array_almost_equal(row, expected)
+        # (S (NP I) (VP (V saw) (NP him))) has height 4, 8 nodes and 3 leaves
+        np.testing.assert_array_almost_equal(
+            TreeStatsVectorizer().transform([[trees[1]]]), [[4, 7 / 8, 3 / 7, 2]]
+        )
+
+    def test_multi_view(self) -> None:
+        """Test if the fused views equal the single transformers' outputs."""
+        nltk_documents = [
+            [nltk.Tree.fromstring(s) for s in TREE_STRINGS[:2]],
+            [nltk.Tree.fromstring(s) for s in TREE_STRINGS[2:]],
+        ]
+        array_documents = StringToTreeTransformer("array").transform(
+            [TREE_STRINGS[:2], TREE_STRINGS[2:]]
+        )
+        chain_transformers = [
+            TreeChainTransformer(),
+            TreeChainTransformer(2, " ", "@", "#"),
+            TreeChainTransformer(2, count_chains=True),
+        ]
+        for documents in [nltk_documents, array_documents]:
+            for chain_transformer in chain_transformers:
+                actual = TreeMultiViewTransformer(
+                    chain_transformer=chain_transformer
+                ).transform(documents)
+                self.assertEqual(
+                    actual["pos"], WordToPosTransformer().transform(documents)
+                )
+                self.assertEqual(
+                    actual["chains"], chain_transformer.transform(documents)
+                )
+                np.testing.assert_array_almost_equal(
+                    actual["stats"], TreeStatsVectorizer().transform(documents)
+                )
+        actual = TreeMultiViewTransformer(["stats"]).transform(nltk_documents)
+        self.assertEqual(list(actual.keys()), ["stats"])
+        self.assertRaises(ValueError, TreeMultiViewTransformer, ["words"])
+
+    def test_multi_view_union(self) -> None:
+        """Test if the views can be consumed by a FeatureUnion."""
+        documents = [[nltk.Tree.fromstring(s)] for s in TREE_STRINGS]
+        pipeline = make_pipeline(
+            TreeMultiViewTransformer(
+                ["chains", "stats"],
+                TreeChainTransformer(2, " ", count_chains=True),
+            ),
+            make_union(
+                make_pipeline(TreeViewSelector("chains"), DictVectorizer()),
+                TreeViewSelector("stats"),
+            ),
+        )
+        actual = pipeline.fit_transform(documents)
+        self.assertEqual(actual.shape[0], len(TREE_STRINGS))
+        np.testing.assert_array_almost_equal(
+            actual[:, -4:].toarray(), TreeStatsVectorizer().transform(documents)
+        )
+
+    def test_pqgrams(self) -> None:
+        """Test pq-grams against the example of Augsten et al. 2010."""
+        trees = [
+            [nltk.Tree.fromstring("(a (a (e) (b)) (b) (c))")],
+            [nltk.Tree.fromstring("(a (a (e) (b)) (b) (d))")],
+        ]
+        strings = [
+            [_pqgrams_recursive(tree, 2, 3) for tree in document][0]
+            for document in trees
+        ]
+        self.assertEqual(len(strings[0]), 13)
+        self.assertIn("*-a-a-b-c", strings[0])
+        actual = PqGramTransformer().transform(trees)
+        self.assertEqual([sum(c.values()) for c in actual], [13, 13])
+        np.testing.assert_array_almost_equal(
+            pqgram_kernel(actual, actual), [[0, 0.470588], [0.470588, 0]]
+        )
+        np.testing.assert_array_almost_equal(
+            pqgram_kernel(actual, actual), pqgram_kernel(strings, strings)
+        )
+        self.assertRaises(ValueError, PqGramTransformer, p=0)
+        self.assertRaises(ValueError, PqGramTransformer, n_features=0)
+
+    def test_pqgrams_like_recursive(self) -> None:
+        """Test if pq-grams are the same as with the recursive algorithm."""
+        random.seed(11)
+        documents = [[_random_tree(5) for _ in range(3)] for _ in range(5)]
+        arrays = [[ArrayTree.from_nltk(tree) for tree in d] for d in documents]
+        for p, q in [(1, 1), (2, 3), (3, 2)]:
+            expected = []
+            for document in documents:
+                counter: Counter = Counter()
+                for tree in document:
+                    counter.update(_pqgrams_recursive(tree, p, q))
+                expected.append(sorted(counter.values()))
+            transformer = PqGramTransformer(p, q)
+            actual = transformer.transform(documents)
+            self.assertEqual([sorted(c.values()) for c in actual], expected)
+            self.assertEqual(transformer.transform(arrays), actual)
+        hashed = PqGramTransformer(n_features=16).transform(documents)
+        self.assertTrue(all(0 <= key < 16 for c in hashed for key in c))
+
+    def test_pqgrams_from_sentences(self) -> None:
+        """Test if stanza sentences are read by their dependency heads."""
+
+        def word(upos: str, head: int) -> SimpleNamespace:
+            return SimpleNamespace(upos=upos, head=head)
+
+        # "the dog barks": the -> dog -> barks -> root
+        sentence = SimpleNamespace(
+            words=[word("DET", 2), word("NOUN", 3), word("VERB", 0)]
+        )
+        document = SimpleNamespace(sentences=[sentence])
+        tree = nltk.Tree.fromstring("(root (VERB (NOUN (DET))))")
+        transformer = PqGramTransformer()
+        self.assertEqual(
+            transformer.transform([document]), transformer.transform([[tree]])
+        )
@@ -2,14 +2,16 @@
 
 import json
 import logging
+import multiprocessing
 import os
-import pickle
 import shutil
+import sqlite3
 import sys
+import unicodedata
 import warnings
 from copy import deepcopy
 from glob import glob
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from urllib.error import HTTPError
 from urllib.request import urlretrieve
 
@@ -19,7 +21,13 @@ import torch
 from tqdm import tqdm  # type: ignore
 from transformers import MarianMTModel, MarianTokenizer  # type: ignore
 
-import stanza  # type: ignore
+from tuhlbox.stanza import (
+    ColumnarDocument,
+    load_document,
+    parse_texts,
+    parsing_pool,
+    save_document,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +46,8 @@ FILES = [
     "vocab.json",
 ]
 MODEL_DIR = "translation_data"
+# inference_mode is only available since torch 1.9
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
 
 
 @click.command(
@@ -111,18 +121,43 @@ def reddit_to_common(input_directory: str, output_directory: str) -> None:
     df.to_csv(meta_file, index=False)
 
 
+def _parse_file(task: Tuple[str, str, str, Optional[str], Optional[str]]) -> str:
+    """Parse a text file and save the stanza document, returns the output path."""
+    in_path, out_path, language, processors, cache_dir = task
+    with open(in_path) as in_fh:
+        content = in_fh.read()
+    try:
+        parsed = parse_texts((language, processors, False, [content], cache_dir))[0]
+    except RuntimeError as e:
+        logger.error("error on parsing %s", in_path)
+        logger.error(content)
+        raise e
+    save_document(parsed, out_path)
+    return out_path
+
+
 @click.command(help="Reads dataset.csv + column name to produce stanza dir")
 @click.argument("input-directory")
 @click.option("-t", "--text-column-name", default=FEATURE_TEXT)
 @click.option("-l", "--language-column-name", default=LANGUAGE_COLUMN)
 @click.option("-o", "--overwrite", default=False)
 @click.option("-out", "--output-column-name", default=FEATURE_STANZA)
+@click.option("-w", "--workers", default=1, help="number of parsing processes")
+@click.option("--threads-per-worker", default=1, help="torch threads per process")
+@click.option("-c", "--cache-dir", default=None, help="directory of the parse cache")
+@click.option("--columnar", is_flag=True, help="store documents as npz columns")
+@click.option("-p", "--processors", default=None, help="e.g. tokenize,pos,lemma")
 def parse_dependency(
     input_directory: str,
     text_column_name: str,
     language_column_name: str,
     overwrite: bool,
     output_column_name: str,
+    workers: int,
+    threads_per_worker: int,
+    cache_dir: Optional[str],
+    columnar: bool,
+    processors: Optional[str],
 ) -> None:
     """
     Parse text files using the stanza parser.
@@ -139,6 +174,18 @@ def parse_dependency(
             the appropriate inputs.
         output_column_name: name of the output column in the meta-data file.
             defaults to 'stanza'.
+        workers: number of processes parsing files in parallel, each with its
+            own stanza pipeline. Defaults to 1, which parses in this process.
+        threads_per_worker: number of torch threads of each worker process.
+            Only used if workers is larger than 1.
+        cache_dir: if set, parsed documents are stored in a parse cache in this
+            directory, and texts that were parsed before (in any file) are
+            loaded from there instead of being parsed again.
+        columnar: if set, the parsed documents are stored as ColumnarDocument
+            (.npz) files instead of pickled stanza documents, which are much
+            faster to load.
+        processors: the stanza processors to run, separated by commas. Defaults
+            to the default processors of each language.
 
     Returns: Nothing, this is a cli script.
 
@@ -152,9 +199,10 @@ def parse_dependency(
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
 
+    extension = ".npz" if columnar else ".pckl"
     df[output_column_name] = [
         os.path.join(
-            output_column_name, os.path.splitext(os.path.basename(f))[0] + ".pckl"
+            output_column_name, os.path.splitext(os.path.basename(f))[0] + extension
         )
         for f in df[text_column_name]
     ]
@@ -178,25 +226,25 @@ def parse_dependency(
         logger.warning("no files remaining, skipping calculation")
         return
 
-    parsers = {}
-    for in_file, out_file, language in tqdm(tuples):
-        if language.endswith("_to_en"):
-            language = "en"
-        if language not in parsers:
-            parsers[language] = stanza.Pipeline(lang=language, use_gpu=False)
-        parser = parsers[language]
-
-        full_path = os.path.join(input_directory, in_file)
-        with open(full_path) as in_fh:
-            content = in_fh.read()
-            try:
-                parsed = parser(content)
-            except RuntimeError as e:
-                logger.error("error on parsing", full_path)
-                logger.error(content)
-                raise e
-            with open(os.path.join(input_directory, out_file), "wb") as out_fh:
-                pickle.dump(parsed, out_fh)
+    tasks = [
+        (
+            os.path.join(input_directory, in_file),
+            os.path.join(input_directory, out_file),
+            "en" if language.endswith("_to_en") else language,
+            processors,
+            cache_dir,
+        )
+        for in_file, out_file, language in tuples
+    ]
+    if workers > 1:
+        with parsing_pool(workers, threads_per_worker) as pool:
+            # send several files at once, but keep all workers busy
+            chunksize = max(1, len(tasks) // (workers * 4))
+            for _ in tqdm(pool.imap(_parse_file, tasks, chunksize), total=len(tasks)):
+                pass
+    else:
+        for task in tqdm(tasks):
+            _parse_file(task)
     logger.info("writing %s", main_dataset_file)
     df.to_csv(main_dataset_file, index=False)
 
@@ -259,6 +307,110 @@ def parse_constituency(
     # pd.concat(sub_dfs, axis=0).to_csv(DATASET_CSV + '2', index=False)
 
 
+def download_model(
+    source_language: str,
+    target_language: str,
+    model_dir: str = "translation_models",
+    force_download: bool = False,
+) -> str:
+    """
+    Download a translation model, unless it has been downloaded before.
+
+    Args:
+        source_language: two-letter code for the source language
+        target_language: two-letter code for the target language
+        model_dir: directory where to store the cached translation models
+        force_download: if true, overwrite existing cached models
+
+    Returns: the directory of the model.
+
+    """
+    model_name = f"opus-mt-{source_language}-{target_language}"
+    model_path = os.path.join(model_dir, model_name)
+    if os.path.isdir(model_path) and not force_download:
+        return model_path
+    if os.path.isdir(model_path):
+        shutil.rmtree(model_path)
+    os.makedirs(model_path)
+    for f in FILES:
+        file_url = os.path.join(HF_URL, model_name, f)
+        file_path = os.path.join(model_path, f)
+        try:
+            logger.info("downloading %s", file_url)
+            urlretrieve(file_url, file_path)
+        except HTTPError as e:
+            logger.error(
+                "Error retrieving model from url." "Please confirm model exists: %s",
+                e,
+            )
+            sys.exit(1)
+    return model_path
+
+
+class TranslationMemory:
+    """Persistent store of sentence translations, kept in a SQLite database."""
+
+    def __init__(self, path: str):
+        """
+        Open (or create) a translation memory.
+
+        Args:
+            path: the SQLite database file. It can be shared by several
+                processes.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "model TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, "
+                "PRIMARY KEY (model, source))"
+            )
+
+    @staticmethod
+    def normalize(sentence: str) -> str:
+        """Return the key of a sentence: NFC-normalized, with collapsed spaces."""
+        return " ".join(unicodedata.normalize("NFC", sentence).split())
+
+    def get(self, model: str, sentences: List[str]) -> Dict[str, str]:
+        """
+        Look up translations.
+
+        Args:
+            model: the name of the translation model.
+            sentences: the normalized source sentences.
+
+        Returns:
+            the translations that were found, by source sentence.
+        """
+        result: Dict[str, str] = {}
+        unique = list(dict.fromkeys(sentences))
+        # stay below the maximum number of sqlite query parameters
+        for start in range(0, len(unique), 500):
+            chunk = unique[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                "SELECT source, target FROM translations "
+                f"WHERE model = ? AND source IN ({placeholders})",
+                [model] + chunk,
+            )
+            result.update(rows)
+        return result
+
+    def put(self, model: str, translations: Dict[str, str]) -> None:
+        """Store translations of normalized source sentences."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?)",
+                [(model, source, target) for source, target in translations.items()],
+            )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.connection.close()
+
+
 class Translator:
     """Simple translator wrapper for Hugging Face models."""
 
@@ -268,6 +420,8 @@ class Translator:
         target_language: str,
         model_dir: str = "translation_models",
         force_download: bool = False,
+        token_budget: int = 1024,
+        memory: TranslationMemory = None,
     ):
         """
         Initialize the translator.
@@ -277,17 +431,26 @@ class Translator:
             target_language: two-letter code for the target language
             model_dir: directory where to store the cached translation models
             force_download: if true, overwrite existing cached models
+            token_budget: maximum number of (padded) source tokens that are
+                translated in one batch. Higher values are faster, but need
+                more memory.
+            memory: if set, sentences are looked up in this translation
+                memory first, and only the missing ones are translated (and
+                then added to it).
         """
+        if token_budget < 1:
+            raise ValueError(f"token_budget must be positive, got {token_budget}")
         self.source_language = source_language
         self.target_language = target_language
         self.model_dir = model_dir
         self.force_download = force_download
+        self.token_budget = token_budget
+        self.memory = memory
 
         self.model_name = f"opus-mt-{self.source_language}-" f"{self.target_language}"
-        self.model_dir = os.path.join(self.model_dir, self.model_name)
-
-        if not os.path.isdir(self.model_dir) or self.force_download:
-            self._download_language_model()
+        self.model_dir = download_model(
+            source_language, target_language, model_dir, force_download
+        )
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info("running on device: %s", self.device)
@@ -297,53 +460,111 @@ class Translator:
         )
         self.tokenizer = MarianTokenizer.from_pretrained(self.model_dir)
 
-    def _download_language_model(self) -> None:
-        if os.path.isdir(self.model_dir):
-            shutil.rmtree(self.model_dir)
-        os.makedirs(self.model_dir)
-        for f in FILES:
-            file_url = os.path.join(HF_URL, self.model_name, f)
-            file_path = os.path.join(self.model_dir, f)
-            try:
-                logger.info("downloading %s", file_url)
-                urlretrieve(file_url, file_path)
-            except HTTPError as e:
-                logger.error(
-                    "Error retrieving model from url."
-                    "Please confirm model exists: %s",
-                    e,
-                )
-                sys.exit(1)
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        """Group sentence indices, longest first, under the token budget."""
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for index in sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True):
+            # the first sentence of a batch is the longest, all others are padded
+            if batch and (len(batch) + 1) * lengths[batch[0]] > self.token_budget:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
 
     def translate(self, sentences: List[str]) -> List[str]:
         """
         Translate sentences for source to target language.
 
         Args:
-            sentences: list of strings to translate. Each sentence will be
-                translated separately for memory reasons.
+            sentences: list of strings to translate. Sentences of similar
+                length are translated together, in batches of at most
+                token_budget tokens. Repeated sentences are only translated
+                once.
 
-        Returns: list of translated sentences.
+        Returns: list of translated sentences, in the order of the input.
 
         """
-        result = []
-        for sentence in tqdm(sentences, leave=False):
-            batch = self.tokenizer.prepare_seq2seq_batch(
-                src_texts=[sentence], return_tensors="pt"
+        keys = [TranslationMemory.normalize(sentence) for sentence in sentences]
+        known = self.memory.get(self.model_name, keys) if self.memory else {}
+        missing = list(dict.fromkeys(key for key in keys if key not in known))
+        if missing:
+            translations = dict(zip(missing, self._translate(missing)))
+            if self.memory:
+                self.memory.put(self.model_name, translations)
+            known.update(translations)
+        return [known[key] for key in keys]
+
+    def _translate(self, sentences: List[str]) -> List[str]:
+        if not sentences:
+            return []
+        encoded = self.tokenizer(sentences, truncation=True)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        result = [""] * len(sentences)
+        for batch in tqdm(self._batches(lengths), leave=False):
+            inputs = self.tokenizer.prepare_seq2seq_batch(
+                src_texts=[sentences[index] for index in batch], return_tensors="pt"
             )
-            translated = self.model.generate(**batch.to(self.device))
-            result += self.tokenizer.batch_decode(translated, skip_special_tokens=True)
+            with inference_mode():
+                translated = self.model.generate(**inputs.to(self.device))
+            decoded = self.tokenizer.batch_decode(translated, skip_special_tokens=True)
+            for index, translation in zip(batch, decoded):
+                result[index] = translation
         return result
 
 
+# the translator of a translation worker process, see _init_translation_worker
+_TRANSLATOR: Optional[Translator] = None
+
+
+def _init_translation_worker(
+    source: str,
+    target: str,
+    token_budget: int,
+    memory_file: Optional[str],
+    torch_threads: int,
+) -> None:
+    global _TRANSLATOR
+    torch.set_num_threads(torch_threads)
+    memory = TranslationMemory(memory_file) if memory_file else None
+    _TRANSLATOR = Translator(source, target, token_budget=token_budget, memory=memory)
+
+
+def _translate_file(task: Tuple[str, str], translator: Translator = None) -> str:
+    """Translate the sentences of a parsed document, returns the output path."""
+    old_path, new_path = task
+    translator = translator or _TRANSLATOR
+    if translator is None:
+        raise ValueError("no translator, use _init_translation_worker first")
+    document = load_document(old_path)
+    if isinstance(document, ColumnarDocument):
+        sentences = document.sentence_texts
+    else:
+        sentences = [sentence.text for sentence in document.sentences]
+    translations = translator.translate(sentences)
+    with open(new_path, "w") as o_f:
+        o_f.write("\n".join(translations))
+    return new_path
+
+
 @click.command(help="translates data")
 @click.argument("input-dir")
 @click.argument("source")
 @click.argument("target")
+@click.option("-b", "--token-budget", default=1024, help="source tokens per batch")
+@click.option("-m", "--memory-file", default=None, help="sqlite translation memory")
+@click.option("-w", "--workers", default=1, help="number of translating processes")
+@click.option("--threads-per-worker", default=1, help="torch threads per process")
 def translate(
     input_dir: str,
     source: str,
     target: str,
+    token_budget: int,
+    memory_file: Optional[str],
+    workers: int,
+    threads_per_worker: int,
 ) -> None:
     """
     Translate common datafrarme corpora.
@@ -355,21 +576,33 @@ def translate(
         input_dir: directory containing the dataset.csv file.
         source: two-letter source language code
         target: two-letter target language code
+        token_budget: maximum number of source tokens translated at once.
+        memory_file: if set, the translations of all sentences are stored in
+            this SQLite file and reused, e.g. for repeated sentences or after
+            an interruption.
+        workers: number of processes translating documents in parallel, each
+            with its own copy of the model. Defaults to 1, which translates in
+            this process.
+        threads_per_worker: number of torch threads of each worker process.
+            Only used if workers is larger than 1.
 
     Returns: Nothing, this is a CLI script.
 
     """
+    if workers < 1 or threads_per_worker < 1:
+        raise ValueError(
+            f"workers and threads_per_worker must be positive, got {workers} and "
+            f"{threads_per_worker}"
+        )
     key = f"marianmt_{source}_to_{target}"
     df = pd.read_csv(os.path.join(input_dir, "dataset.csv"))
     df = df.drop(columns=[c for c in df.columns if c.startswith("Unnamed: 0")])
     sub_df = df[df["language"] == source]
 
-    logger.info("loading translation model")
-    translator = Translator(source, target)
-
-    new_rows = []
+    new_rows = {}
+    tasks = []
 
-    for index, row in tqdm(sub_df.iterrows(), total=sub_df.shape[0]):
+    for index, row in sub_df.iterrows():
         new_row = deepcopy(row)
         old_path = os.path.join(input_dir, row["stanza"])
         old_name = os.path.splitext(os.path.basename(old_path))[0]
@@ -392,14 +625,33 @@ def translate(
         if os.path.isfile(new_path):
             continue
 
-        with open(old_path, "rb") as i_f, open(new_path, "w") as o_f:
-            document = pickle.load(i_f)
-            sentences = [sentence.text for sentence in document.sentences]
-            translations = translator.translate(sentences)
-            o_f.write("\n".join(translations))
-
-        new_rows.append(new_row)
-
-    df2 = pd.DataFrame.from_records(new_rows)
+        new_rows[new_path] = new_row
+        tasks.append((old_path, new_path))
+
+    if workers > 1:
+        # download the model once, and not in every worker at the same time
+        download_model(source, target)
+        logger.info("loading translation model in %d workers", workers)
+        context = multiprocessing.get_context("spawn")
+        initargs = (source, target, token_budget, memory_file, threads_per_worker)
+        with context.Pool(workers, _init_translation_worker, initargs) as pool:
+            # every worker takes the next document when it is done
+            done = list(
+                tqdm(pool.imap_unordered(_translate_file, tasks), total=len(tasks))
+            )
+    else:
+        logger.info("loading translation model")
+        memory = TranslationMemory(memory_file) if memory_file else None
+        translator = Translator(
+            source, target, token_budget=token_budget, memory=memory
+        )
+        done = [_translate_file(task, translator) for task in tqdm(tasks)]
+        if memory:
+            memory.close()
+
+    finished = set(done)
+    df2 = pd.DataFrame.from_records(
+        [new_row for path, new_row in new_rows.items() if path in finished]
+    )
     df3 = pd.concat([df, df2])
     df3.to_csv(os.path.join(input_dir, "dataset.csv"), index=False)
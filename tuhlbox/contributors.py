@@ -6,14 +6,20 @@ from collections import Counter, defaultdict
 from typing import Any, Dict, List
 
 import langdetect
+import numpy as np
 import pandas as pd
 from sklearn.pipeline import make_pipeline
 from tqdm import tqdm
 from treegrams.transformers import TreeGramExtractor
 
-import stanza
 from tuhlbox import logger
-from tuhlbox.stanza import StanzaToNltkTreesTransformer
+from tuhlbox.stanza import (
+    ColumnarDocument,
+    StanzaToNltkTreesTransformer,
+    load_document,
+    parse_texts,
+    save_document,
+)
 
 
 class Contributor(ABC):
@@ -58,6 +64,8 @@ class Contributor(ABC):
         if mode == "pickle":
             with open(full_path, "rb") as pickle_fh:
                 return pickle.load(pickle_fh)
+        if mode == "stanza":
+            return load_document(full_path)
 
     def write_subdir_file(self, path: str, content: Any, mode: str = "text") -> None:
         full_path = os.path.join(self.base_dir, path)
@@ -67,6 +75,8 @@ class Contributor(ABC):
         if mode == "pickle":
             with open(full_path, "wb") as pickle_fh:
                 pickle.dump(content, pickle_fh)
+        if mode == "stanza":
+            save_document(content, full_path)
 
 
 class RowWiseContributor(Contributor):
@@ -101,31 +111,48 @@ class LinguisticStatsContributor(RowWiseContributor):
         )
 
     def calculate_row(self, row: pd.Series) -> pd.Series:
-        document = self.read_subdir_file(row["stanza"], "pickle")
+        document = self.read_subdir_file(row["stanza"], "stanza")
         fields = ["upos", "xpos", "lemma", "text", "deprel"]
-        sets = defaultdict(set)
-        for word in document.iter_words():
+        result: Dict[str, Any] = {}
+        if isinstance(document, ColumnarDocument):
             for field in fields:
-                sets[field].add(getattr(word, field))
-        result: Dict[str, Any] = {f: len(sets[f]) for f in fields}
+                result[field] = len(np.unique(document.arrays[field]))
+            sentence_lengths = document.arrays["sentence_tokens"].tolist()
+        else:
+            sets = defaultdict(set)
+            for word in document.iter_words():
+                for field in fields:
+                    sets[field].add(getattr(word, field))
+            result = {f: len(sets[f]) for f in fields}
+            sentence_lengths = [len(sent.tokens) for sent in document.sentences]
         result["tokens"] = document.num_tokens
         result["words"] = document.num_words
         result["characters"] = len(f"{document.text}")
-        result["sentence_lengths"] = [len(sent.tokens) for sent in document.sentences]
+        result["sentence_lengths"] = sentence_lengths
         row[self.column_name] = json.dumps(result)
         return row
 
 
 class StanzaContributor(RowWiseContributor):
-    def __init__(self, directory_name: str = "stanza", **kwargs: Any) -> None:
+    def __init__(
+        self,
+        directory_name: str = "stanza",
+        cache_dir: str = None,
+        columnar: bool = False,
+        processors: str = "tokenize,pos,depparse,lemma",
+        **kwargs: Any,
+    ) -> None:
         super().__init__(
             column_name="stanza",
             required_columns=["text_raw", "language"],
             flush_after_each_row=True,
             **kwargs,
         )
-        self.parsers: Dict[str, stanza.Pipeline] = {}
         self.directory_name = directory_name
+        self.cache_dir = cache_dir
+        self.processors = processors
+        # columnar documents load much faster, see ColumnarDocument
+        self.extension = ".npz" if columnar else ".pckl"
 
     def calculate_row(self, row: pd.Series) -> pd.Series:
         lang = row["language"]
@@ -133,18 +160,16 @@ class StanzaContributor(RowWiseContributor):
         stanza_dir = os.path.join(self.base_dir, self.directory_name)
         if not os.path.isdir(stanza_dir):
             os.makedirs(stanza_dir)
-        out_filename = os.path.splitext(os.path.basename(input_filename))[0] + ".pckl"
+        out_filename = os.path.splitext(os.path.basename(input_filename))[0]
+        out_filename += self.extension
         out_filepath = os.path.join(self.directory_name, out_filename)
         full_out_filepath = os.path.join(self.base_dir, out_filepath)
 
         if not os.path.isfile(full_out_filepath) or self.overwrite:
             text = self.read_subdir_file(input_filename)
-            if lang not in self.parsers:
-                self.parsers[lang] = stanza.Pipeline(
-                    lang=lang, use_gpu=False, processors="tokenize,pos,depparse,lemma"
-                )
-            document = self.parsers[lang](text)
-            self.write_subdir_file(out_filepath, document, "pickle")
+            task = (lang, self.processors, False, [text], self.cache_dir)
+            document = parse_texts(task)[0]
+            self.write_subdir_file(out_filepath, document, "stanza")
         row[self.column_name] = out_filepath
         return row
 
@@ -185,7 +210,7 @@ class CounterContributor(RowWiseContributor):
         )
 
     def calculate_row(self, row: pd.Series) -> pd.Series:
-        stanza_document = self.read_subdir_file(row["stanza"], mode="pickle")
+        stanza_document = self.read_subdir_file(row["stanza"], mode="stanza")
 
         counter_dir = os.path.join(self.base_dir, self.directory_name)
         if not os.path.isdir(counter_dir):
@@ -3,7 +3,7 @@ from __future__ import annotations
 
 import random
 from collections import defaultdict
-from typing import Dict, List, Union
+from typing import Any, Dict, Iterable, Iterator, List, Union
 
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
@@ -43,6 +43,61 @@ def get_features_for_sample(sample: List[str]) -> List[int]:
     return [v0, v1, v2, v3]
 
 
+def _threshold_bucket(occurrences: int) -> int:
+    """Return the threshold count (1-3) a word with <occurrences> belongs to."""
+    if occurrences <= 1:
+        return 1
+    if occurrences <= 4:
+        return 2
+    if occurrences <= 10:
+        return 3
+    return 0  # words occurring more than 10 times are not counted
+
+
+def get_features_for_nested_samples(
+    sample: List[str], sizes: List[int]
+) -> List[List[int]]:
+    """
+    Calculate statistical features for several prefixes of a sample at once.
+
+    The features are the same as those of get_features_for_sample, but
+    instead of counting each prefix separately, the counts are updated
+    incrementally while walking along the sample once.
+
+    Args:
+        sample: a list of words to calculate metrics from.
+        sizes: the prefix lengths for which features are returned. Must be
+            sorted in ascending order and must not exceed the sample length.
+
+    Returns: a list containing the four threshold counts (see
+        get_features_for_sample) of each prefix.
+    """
+    counts: Dict[str, int] = defaultdict(int)
+    buckets = [0, 0, 0, 0]
+    result = []
+    position = 0
+    for size in sizes:
+        while position < size:
+            word = sample[position]
+            occurrences = counts[word]
+            if occurrences > 0:
+                buckets[_threshold_bucket(occurrences)] -= 1
+            buckets[_threshold_bucket(occurrences + 1)] += 1
+            counts[word] = occurrences + 1
+            position += 1
+        result.append([len(counts), buckets[1], buckets[2], buckets[3]])
+    return result
+
+
+def _aggregate_features(features: np.ndarray) -> np.ndarray:
+    """Calculate the means and mean/std ratios of the features of all samples."""
+    means = np.mean(features, axis=0)
+    stds = np.std(features, axis=0)
+    return np.concatenate(
+        [means, np.divide(means, stds, out=np.zeros_like(means), where=stds != 0)]
+    )
+
+
 class LifeVectorizer(BaseEstimator, TransformerMixin):
     """Implementation of Llorens 2016."""
 
@@ -52,6 +107,8 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
         samples: int = 200,
         sample_type: str = "bow",
         force: bool = True,
+        nested_samples: bool = False,
+        dtype: Any = np.float32,
     ):
         """
         Initialize the transformer.
@@ -61,6 +118,15 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
             samples: how many samples per window size are captured
             sample_type: how the samples are created
             force: if true, calculates samples of too-short texts.
+            nested_samples: if true, only <samples> "bow" samples of the
+                largest fragment size are drawn per document, and the features
+                of all smaller fragment sizes are read off their prefixes. This
+                reduces the sampling work by roughly the number of fragment
+                sizes, but the samples of different sizes are no longer
+                independent from each other. "fragment" samples are always
+                drawn separately for each size, as the prefixes of a window
+                are not uniformly placed windows of a smaller size.
+            dtype: the type of the returned feature matrix.
         """
         if fragment_sizes is None:
             fragment_sizes = [200, 500, 800, 1000, 1500, 2000, 3000, 4000]
@@ -74,6 +140,8 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
         self.samples = samples
         self.sample_type = sample_type
         self.force = force
+        self.nested_samples = nested_samples
+        self.dtype = dtype
 
     def fit(self, _x: List[str], _y: Union[List, np.ndarray] = None) -> LifeVectorizer:
         """Fit the model."""
@@ -98,15 +166,7 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
         """
         ret = []
         wordcount = len(words)
-        if wordcount < fragment_size:
-            if self.force:
-                fragment_size = wordcount
-            else:
-                raise ValueError(
-                    f"fragment size ({fragment_size}) is larger than document "
-                    f"size ({wordcount}) for document starting with: \n\n"
-                    f'{" ".join(words[:50])}\n\n'
-                )
+        fragment_size = self._check_fragment_size(words, fragment_size)
         for _ in range(self.samples):
             if method == "fragment":
                 left = random.randint(0, wordcount - fragment_size)
@@ -116,6 +176,24 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
                 ret.append(random.sample(words, fragment_size))
         return ret
 
+    def _check_fragment_size(self, words: List[str], fragment_size: int) -> int:
+        """Return the fragment size that can actually be sampled from <words>."""
+        wordcount = len(words)
+        if wordcount < fragment_size:
+            if self.force:
+                return wordcount
+            raise ValueError(
+                f"fragment size ({fragment_size}) is larger than document "
+                f"size ({wordcount}) for document starting with: \n\n"
+                f'{" ".join(words[:50])}\n\n'
+            )
+        return fragment_size
+
+    def _get_methods(self) -> List[str]:
+        if self.sample_type == "both":
+            return ["bow", "fragment"]
+        return [self.sample_type]
+
     def get_features(
         self,
         document: List[str],
@@ -142,21 +220,80 @@ class LifeVectorizer(BaseEstimator, TransformerMixin):
         features_as_list = []
         for sample in samples:
             features_as_list.append(get_features_for_sample(sample))
-        features = np.array(features_as_list)
-        means = np.mean(features, axis=0)
-        stds = np.std(features, axis=0)
-        return np.concatenate(
-            [means, np.divide(means, stds, out=np.zeros_like(means), where=stds != 0)]
+        return _aggregate_features(np.array(features_as_list))
+
+    def _get_nested_features(self, document: List[str], method: str) -> np.ndarray:
+        """
+        Extract features for all fragment sizes from shared samples.
+
+        Returns:
+            an array with one row of features for each fragment size.
+        """
+        sizes = [self._check_fragment_size(document, s) for s in self.fragment_sizes]
+        order = np.argsort(sizes, kind="stable")
+        sorted_sizes = [sizes[i] for i in order]
+        features = np.zeros((self.samples, len(sizes), 4))
+        # the prefixes of a random permutation of the largest size are random
+        # permutations of every smaller size. this does not hold for
+        # "fragment", whose windows can only start in [0, N - largest size].
+        for i, sample in enumerate(self.sample(document, sorted_sizes[-1], method)):
+            features[i, order] = get_features_for_nested_samples(sample, sorted_sizes)
+        return np.array(
+            [_aggregate_features(features[:, j]) for j in range(len(sizes))]
         )
 
+    def _get_width(self) -> int:
+        """Return the number of features calculated for each document."""
+        return len(self.fragment_sizes) * len(self._get_methods()) * 8
+
+    def _write_features(self, document: List[str], out: np.ndarray) -> None:
+        """Calculate the features of a document into the row <out>."""
+        methods = self._get_methods()
+        # one block per fragment size, with the methods side by side
+        view = out.reshape(len(self.fragment_sizes), len(methods), 8)
+        for k, method in enumerate(methods):
+            if self.nested_samples and method == "bow":
+                view[:, k] = self._get_nested_features(document, method)
+            else:
+                for j, size in enumerate(self.fragment_sizes):
+                    view[j, k] = self._get_features(document, size, method)
+
     def transform(
         self, x: List[List[str]], _y: Union[List, np.ndarray] = None
     ) -> np.ndarray:
         """Calculate samples and extracts features from documents."""
-        ret = []
-        for document in x:
-            doc = [self.get_features(document, size) for size in self.fragment_sizes]
-            ret.append(np.concatenate(doc))
-
+        documents = x if hasattr(x, "__len__") else list(x)
         # some classifiers like XGBoost require a numpy array if nested
-        return np.array(ret)
+        result = np.empty((len(documents), self._get_width()), dtype=self.dtype)
+        for i, document in enumerate(documents):
+            self._write_features(document, result[i])
+        return result
+
+    def transform_chunks(
+        self, x: Iterable[List[str]], chunk_size: int = 1000
+    ) -> Iterator[np.ndarray]:
+        """
+        Calculate features lazily, for corpora too large to be held at once.
+
+        Args:
+            x: an iterable of documents, which is only consumed as far as
+                needed for the next chunk.
+            chunk_size: how many documents (rows) are returned per chunk.
+
+        Returns:
+            an iterator over feature matrices of <chunk_size> rows each. The
+            last chunk may be smaller.
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk size must be positive, got {chunk_size}")
+        chunk = np.empty((chunk_size, self._get_width()), dtype=self.dtype)
+        rows = 0
+        for document in x:
+            self._write_features(document, chunk[rows])
+            rows += 1
+            if rows == chunk_size:
+                yield chunk
+                chunk = np.empty_like(chunk)
+                rows = 0
+        if rows:
+            yield chunk[:rows]
@@ -1,18 +1,51 @@
 """Transformers that use stanza documents."""
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import itertools
 import json
 import logging
+import mmap
+import multiprocessing
+import multiprocessing.pool
 import os
+import pickle
+import struct
+import sys
+import threading
 import warnings
-from typing import Any, Dict, Iterable, List, Union
+import weakref
+import zipfile
+from collections import OrderedDict
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Sized,
+    Tuple,
+    Union,
+)
 
 import nltk
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
 from tqdm import tqdm
 
 import stanza
 from stanza.models.common.doc import Document, Sentence, Word
+from tuhlbox.tree import LabelTable
 
 logger = logging.getLogger(__name__)
 
@@ -44,62 +77,1000 @@ def _get_word_attribute(
     return features[attribute]
 
 
-def _get_features_per_word(document: Document) -> List[Dict[str, str]]:
-    result = []
-    words = []
-    for sentence in document.sentences:
-        words += sentence.words
-    for word in words:
-        features = word.feats
-        if not features or features == "_":
-            continue
-        pairs = features.split("|")
-        result.append({k: v for (k, v) in [x.split("=") for x in pairs]})
-    return result
+class PipelineRegistry:
+    """
+    Keeps loaded stanza pipelines, so they can be shared in the same process.
+
+    Pipelines are built on first use and identified by their language,
+    processors and device. If max_bytes is set, the least recently used
+    pipelines are dropped from the registry when the estimated size of all
+    model weights exceeds it. The pipeline that was requested last is never
+    dropped.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        """
+        Initialize the registry.
+
+        Args:
+            max_bytes: memory budget for the model weights of all pipelines.
+                If None, pipelines are never evicted.
+        """
+        self.max_bytes = max_bytes
+        self._pipelines: OrderedDict[Tuple[Any, ...], stanza.Pipeline] = OrderedDict()
+        self._sizes: Dict[Tuple[Any, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        language: str,
+        processors: Union[str, Dict[str, str]] = None,
+        use_gpu: bool = False,
+        pretokenized: bool = False,
+    ) -> stanza.Pipeline:
+        """Return the pipeline with the given settings, building it if needed."""
+        key = _pipeline_key(language, processors, use_gpu) + (pretokenized,)
+        with self._lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is not None:
+                self._pipelines.move_to_end(key)
+                return pipeline
+            logger.info("loading stanza pipeline %s", key)
+            kwargs: Dict[str, Any] = {}
+            if processors is not None:
+                kwargs["processors"] = processors
+            if pretokenized:
+                kwargs["tokenize_pretokenized"] = True
+            pipeline = stanza.Pipeline(lang=language, use_gpu=use_gpu, **kwargs)
+            self._pipelines[key] = pipeline
+            self._sizes[key] = _pipeline_size(pipeline)
+            self._evict()
+            return pipeline
+
+    def _evict(self) -> None:
+        """Drop least recently used pipelines until the budget is met."""
+        if self.max_bytes is None:
+            return
+        while len(self._pipelines) > 1 and self.nbytes > self.max_bytes:
+            key, _ = self._pipelines.popitem(last=False)
+            del self._sizes[key]
+            logger.info("evicting stanza pipeline %s", key)
+
+    @property
+    def nbytes(self) -> int:
+        """Return the estimated size of all model weights in the registry."""
+        return sum(self._sizes.values())
+
+    def clear(self) -> None:
+        """Drop all pipelines."""
+        with self._lock:
+            self._pipelines.clear()
+            self._sizes.clear()
+
+    def __len__(self) -> int:
+        """Return the number of loaded pipelines."""
+        return len(self._pipelines)
+
+
+def _pipeline_key(
+    language: str, processors: Union[str, Dict[str, str], None], use_gpu: bool
+) -> Tuple[Any, ...]:
+    key: Union[str, Tuple[Tuple[str, str], ...], None] = None
+    if isinstance(processors, dict):
+        key = tuple(sorted(processors.items()))
+    elif isinstance(processors, str):
+        key = ",".join(sorted(p.strip() for p in processors.split(",")))
+    return language, key, bool(use_gpu)
+
+
+# the stanza processors (in pipeline order) and the processors they depend on
+PROCESSORS = ["tokenize", "mwt", "pos", "lemma", "depparse", "ner"]
+PROCESSOR_REQUIREMENTS = {
+    "pos": ["tokenize"],
+    "lemma": ["tokenize", "pos"],
+    "depparse": ["tokenize", "pos", "lemma"],
+    "ner": ["tokenize"],
+}
+# the processor that produces each word field, all other fields are feats
+FIELD_PROCESSORS = {
+    "text": "tokenize",
+    "upos": "pos",
+    "xpos": "pos",
+    "feats": "pos",
+    "lemma": "lemma",
+    "deprel": "depparse",
+    "dependency": "depparse",
+    "head": "depparse",
+    "ner": "ner",
+}
+
+
+def processors_for_fields(fields: Iterable[str]) -> str:
+    """
+    Return the stanza processors that are needed for some word fields.
+
+    Args:
+        fields: names of word attributes (e.g., upos or head) or features
+            (e.g., Number), as used by the transformers of this module.
+
+    Returns:
+        a comma-separated string of processors, as expected by stanza.
+        Multi-word token expansion (mwt) is added by stanza if a language
+        requires it.
+    """
+    needed = {"tokenize"}
+    for field in fields:
+        processor = FIELD_PROCESSORS.get(field, "pos")
+        needed.add(processor)
+        needed.update(PROCESSOR_REQUIREMENTS.get(processor, []))
+    return ",".join(p for p in PROCESSORS if p in needed)
+
+
+def _required_fields(estimator: Any) -> Optional[List[str]]:
+    """Return the fields needed by an estimator, or None if they are unknown."""
+    if hasattr(estimator, "required_fields"):
+        return estimator.required_fields()
+    if hasattr(estimator, "steps"):  # Pipeline
+        return _required_fields(estimator.steps[0][1]) if estimator.steps else []
+    if hasattr(estimator, "transformer_list"):  # FeatureUnion
+        fields: List[str] = []
+        for _, transformer in estimator.transformer_list:
+            if transformer in (None, "drop"):
+                continue
+            required = _required_fields(transformer)
+            if required is None:
+                return None
+            fields += required
+        return fields
+    return None
+
+
+def resolve_processors(estimator: Any) -> Any:
+    """
+    Set the processors of all parsers with processors="auto" in a pipeline.
+
+    The processors of such a StanzaParserTransformer are derived from the
+    fields that the following steps read (see required_fields of the
+    transformers of this module), possibly nested in FeatureUnions or other
+    Pipelines. If the following step is not a transformer of this module,
+    the default processors of stanza are used.
+
+    Args:
+        estimator: a Pipeline, FeatureUnion or single transformer.
+
+    Returns:
+        the estimator, whose parsers were updated in place.
+    """
+    children = []
+    if hasattr(estimator, "steps"):
+        steps = [step for _, step in estimator.steps]
+        for step, following in zip(steps, steps[1:] + [None]):
+            if isinstance(step, StanzaParserTransformer) and step.processors == "auto":
+                fields = None if following is None else _required_fields(following)
+                processors = None if fields is None else processors_for_fields(fields)
+                logger.info("using stanza processors: %s", processors or "default")
+                step.set_params(processors=processors)
+        children = steps
+    elif hasattr(estimator, "transformer_list"):
+        children = [transformer for _, transformer in estimator.transformer_list]
+    for child in children:
+        resolve_processors(child)
+    return estimator
+
+
+def _pipeline_size(pipeline: stanza.Pipeline) -> int:
+    """Estimate the number of bytes used by the weights of a pipeline."""
+    seen = set()
+    size = 0
+    for processor in pipeline.processors.values():
+        # the models are stored on the processor or on its trainer
+        candidates = list(vars(processor).values())
+        for candidate in list(candidates):
+            if hasattr(candidate, "__dict__") and not hasattr(candidate, "parameters"):
+                candidates += vars(candidate).values()
+        for candidate in candidates:
+            if id(candidate) in seen or not callable(
+                getattr(candidate, "parameters", None)
+            ):
+                continue
+            seen.add(id(candidate))
+            for parameter in candidate.parameters():
+                if id(parameter) not in seen:
+                    seen.add(id(parameter))
+                    size += parameter.numel() * parameter.element_size()
+    return size
+
+
+PIPELINES = PipelineRegistry()
+
+
+def get_pipeline(
+    language: str,
+    processors: Union[str, Dict[str, str]] = None,
+    use_gpu: bool = False,
+    pretokenized: bool = False,
+) -> stanza.Pipeline:
+    """
+    Return a shared stanza pipeline from the process-wide registry.
+
+    Set PIPELINES.max_bytes to limit the memory used by the registry.
+
+    Args:
+        language: the language of the pipeline.
+        processors: the stanza processors to load. If None, the default
+            processors of stanza are used.
+        use_gpu: whether the pipeline should run on the gpu.
+        pretokenized: whether the pipeline expects tokenized sentences
+            instead of text.
+    """
+    return PIPELINES.get(language, processors, use_gpu, pretokenized)
+
+
+class ParseCache:
+    """
+    Stores parsed stanza documents on disk, addressed by their content.
+
+    Each document is stored under a hash of its text, the language, the
+    processors, the stanza version and whether it was parsed sentence by
+    sentence (see _parse_bucketed), so that equal texts are only parsed once,
+    regardless of where they come from.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: where the parsed documents are stored. It is created if
+                it does not exist.
+        """
+        self.directory = directory
+
+    def _path(
+        self,
+        text: str,
+        language: str,
+        processors: Union[str, Dict[str, str], None],
+        bucketed: bool,
+    ) -> str:
+        key: Tuple[Any, ...] = (
+            stanza.__version__,
+            _pipeline_key(language, processors, False),
+        )
+        if bucketed:
+            key += ("bucketed",)
+        digest = hashlib.sha256(repr(key).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        name = digest.hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".pckl")
+
+    def get(
+        self,
+        text: str,
+        language: str,
+        processors: Union[str, Dict[str, str]] = None,
+        bucketed: bool = False,
+    ) -> Optional[Document]:
+        """Return the cached document, or None if the text was not parsed yet."""
+        try:
+            path = self._path(text, language, processors, bucketed)
+            with open(path, "rb") as in_fh:
+                return pickle.load(in_fh)
+        except FileNotFoundError:
+            return None
+
+    def put(
+        self,
+        text: str,
+        language: str,
+        processors: Union[str, Dict[str, str], None],
+        document: Document,
+        bucketed: bool = False,
+    ) -> None:
+        """Store a parsed document."""
+        path = self._path(text, language, processors, bucketed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so that concurrent readers never
+        # see half-written documents
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as out_fh:
+            pickle.dump(document, out_fh)
+        os.replace(temporary, path)
+
+
+class ParseTask(NamedTuple):
+    """The arguments of parse_texts, so it can be mapped over a worker pool."""
+
+    language: str
+    processors: Union[str, Dict[str, str], None] = None
+    use_gpu: bool = False
+    texts: Sequence[str] = ()
+    cache_dir: Optional[str] = None
+    token_budget: Optional[int] = None
+
+
+def parse_texts(task: Union[ParseTask, Tuple]) -> List[Document]:
+    """
+    Parse several texts with a single call of a shared pipeline.
+
+    Args:
+        task: a ParseTask (or a tuple of its fields). If cache_dir is set,
+            texts found in the ParseCache there are not parsed again, and new
+            ones are added to it. If token_budget is set, the texts are
+            parsed sentence by sentence, see _parse_bucketed.
+
+    Returns:
+        a stanza Document for each text.
+    """
+    language, processors, use_gpu, texts, cache_dir, token_budget = ParseTask(*task)
+    cache = ParseCache(cache_dir) if cache_dir else None
+    documents: Dict[str, Document] = {}
+    if cache:
+        for text in texts:
+            if text not in documents:
+                cached = cache.get(text, language, processors, bool(token_budget))
+                if cached is not None:
+                    documents[text] = cached
+    # equal texts are only parsed once
+    missing = list(dict.fromkeys(text for text in texts if text not in documents))
+    if missing:
+        if token_budget:
+            parsed = _parse_bucketed(
+                missing, language, processors, use_gpu, token_budget
+            )
+        else:
+            nlp = get_pipeline(language, processors, use_gpu)
+            parsed = nlp([Document([], text=text) for text in missing])
+        for text, document in zip(missing, parsed):
+            documents[text] = document
+            if cache:
+                cache.put(text, language, processors, document, bool(token_budget))
+    return [documents[text] for text in texts]
+
+
+def _token_batches(lengths: List[int], token_budget: int) -> Iterator[List[int]]:
+    """
+    Group sentences into batches of similar length under a token budget.
+
+    Args:
+        lengths: the number of tokens of each sentence.
+        token_budget: the maximum number of tokens of a batch. Longer
+            sentences are put into a batch of their own.
+
+    Returns:
+        an iterator over lists of sentence indices, shortest sentences first.
+    """
+    batch: List[int] = []
+    tokens = 0
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if batch and tokens + lengths[index] > token_budget:
+            yield batch
+            batch = []
+            tokens = 0
+        batch.append(index)
+        tokens += lengths[index]
+    if batch:
+        yield batch
+
+
+def _parse_bucketed(
+    texts: List[str],
+    language: str,
+    processors: Union[str, Dict[str, str], None],
+    use_gpu: bool,
+    token_budget: int,
+) -> List[Document]:
+    """
+    Parse texts by regrouping their sentences into length-sorted batches.
+
+    The texts are only split into sentences (and multi-word tokens into their
+    words, for languages that have them) first. Then the sentences of all
+    texts are sorted by their number of words and parsed by a pretokenized
+    pipeline in batches of at most token_budget words, so that the batches of
+    the neural processors contain little padding, and long texts don't need
+    more memory than short ones. Finally, the results are copied to the words
+    of the split documents, which keep the tokens and character offsets of
+    the tokenizer.
+    """
+    # stanza adds the mwt processor for languages with multi-word tokens
+    tokenizer = get_pipeline(language, "tokenize", use_gpu)
+    segmented = tokenizer([Document([], text=text) for text in texts])
+    sentences = [sentence for document in segmented for sentence in document.sentences]
+    # the pretokenized pipeline doesn't expand multi-word tokens, so it gets
+    # the words instead of the tokens
+    words = [[word.text for word in sentence.words] for sentence in sentences]
+    nlp = get_pipeline(language, processors, use_gpu, pretokenized=True)
+    for batch in _token_batches([len(w) for w in words], token_budget):
+        parsed = nlp([words[position] for position in batch])
+        for position, sentence in zip(batch, parsed.sentences):
+            _copy_annotations(sentence, sentences[position])
+    for document in segmented:
+        if any(getattr(token, "ner", None) for token in document.iter_tokens()):
+            document.build_ents()
+    return segmented
+
+
+# the word attributes that the processors after the tokenizer annotate
+PARSED_FIELDS = ["lemma", "upos", "xpos", "feats", "head", "deprel"]
+
+
+def _copy_annotations(source: Sentence, target: Sentence) -> None:
+    """Copy the annotations of a pretokenized sentence to the split sentence."""
+    for source_word, word in zip(source.words, target.words):
+        for field in PARSED_FIELDS:
+            value = getattr(source_word, field, None)
+            if value is not None:
+                setattr(word, field, value)
+    if target.words and target.words[0].head is not None:
+        target.build_dependencies()
+    # named entities are annotated on the tokens, which are the words of the
+    # source sentence. multi-word tokens get the entity of their first word.
+    position = 0
+    for token in target.tokens:
+        ner = getattr(source.tokens[position], "ner", None)
+        if ner is not None:
+            token.ner = ner
+        position += len(token.words)
+
+
+def _init_worker(torch_threads: int) -> None:
+    torch.set_num_threads(torch_threads)
+    # stanza is very 'loud'.
+    warnings.simplefilter("ignore")
+
+
+def parsing_pool(processes: int, torch_threads: int = 1) -> multiprocessing.pool.Pool:
+    """
+    Create a pool of worker processes for parsing.
+
+    Each worker loads its own pipelines (see get_pipeline) on first use and
+    restricts torch to torch_threads threads, so that the workers don't
+    compete for the same cores. The workers are spawned instead of forked,
+    as forking a process that has already initialized torch can deadlock.
+
+    Args:
+        processes: the number of worker processes.
+        torch_threads: the number of threads each worker may use.
+    """
+    if processes < 1 or torch_threads < 1:
+        raise ValueError(
+            f"processes and torch_threads must be positive, got {processes} and "
+            f"{torch_threads}"
+        )
+    context = multiprocessing.get_context("spawn")
+    return context.Pool(processes, initializer=_init_worker, initargs=(torch_threads,))
+
+
+def _word_key(word: Word) -> Any:
+    """Return the identifier of a word, which depends on the stanza version."""
+    if hasattr(word, "id"):
+        return word.id
+    return word.index
+
+
+def _length_hint(x: Iterable) -> Optional[int]:
+    """Return the length of x, if it is known without consuming it."""
+    return len(x) if isinstance(x, Sized) else None
+
+
+# the word attributes that are stored as columns of a WordTable
+WORD_FIELDS = ["text", "lemma", "upos", "xpos", "deprel"]
+
+
+class WordTable:
+    """
+    Columnar representation of the words of a stanza document.
+
+    The word attributes of WORD_FIELDS and the values of the morphological
+    features (feats) are stored as numpy arrays of ids from the labels of the
+    table, with -1 marking missing values. The heads and the ids of the words
+    are stored as integers. This way, the feats strings are only split once per document, and all
+    transformers can read any attribute of all words with a single lookup.
+
+    The table does not keep the words (which reference their document), so
+    that the cache of WordTable.of does not keep documents alive. Other
+    attributes of the words are read from the document on every call.
+    """
+
+    __slots__ = [
+        "labels",
+        "columns",
+        "feats",
+        "head",
+        "word_ids",
+        "sentence_offsets",
+        "_source",
+    ]
+
+    def __init__(self, document: Union[Document, Sentence]):
+        """
+        Build the table.
+
+        Args:
+            document: a stanza document or sentence.
+        """
+        self._source: Optional[weakref.ref] = weakref.ref(document)
+        sentences = [document] if isinstance(document, Sentence) else document.sentences
+        words = [word for sentence in sentences for word in sentence.words]
+        lengths = [len(sentence.words) for sentence in sentences]
+        self.sentence_offsets = np.cumsum([0] + lengths)
+        self.labels = LabelTable()
+        intern = self.labels.intern
+        self.columns: Dict[str, np.ndarray] = {}
+        for field in WORD_FIELDS:
+            values = [getattr(word, field, None) for word in words]
+            self.columns[field] = np.array(
+                [-1 if value is None else intern(value) for value in values],
+                dtype=np.int32,
+            )
+        self.head = np.array([word.head or 0 for word in words], dtype=np.int32)
+        # like ColumnarDocument, multi-word token ids are replaced by positions
+        self.word_ids = np.array(
+            [
+                word.id if isinstance(word.id, int) else position
+                for sentence in sentences
+                for position, word in enumerate(sentence.words, start=1)
+            ],
+            dtype=np.int32,
+        )
+        self.feats: Dict[str, np.ndarray] = {}
+        for position, word in enumerate(words):
+            features = word.feats
+            if not features or features == "_":
+                continue
+            for pair in features.split("|"):
+                key, value = pair.split("=")
+                column = self.feats.get(key)
+                if column is None:
+                    column = np.full(len(words), -1, dtype=np.int32)
+                    self.feats[key] = column
+                column[position] = intern(value)
+
+    @classmethod
+    def of(cls, document: AnyDocument) -> WordTable:
+        """
+        Return the table of a document or sentence.
+
+        The table is built on first use and kept as long as the document
+        exists, so that several transformers can share it.
+        """
+        table = _WORD_TABLES.get(document)
+        if table is None:
+            if isinstance(document, ColumnarDocument):
+                table = cls.from_columnar(document)
+            else:
+                table = cls(document)
+            _WORD_TABLES[document] = table
+        return table
+
+    @classmethod
+    def from_columnar(cls, document: ColumnarDocument) -> WordTable:
+        """Build the table of a columnar document, without creating words."""
+        table = cls.__new__(cls)
+        table._source = None
+        table.sentence_offsets = np.asarray(document.arrays["sentence_offsets"])
+        table.head = np.asarray(document.arrays["head"], dtype=np.int32)
+        table.word_ids = np.asarray(document.arrays["id"], dtype=np.int32)
+        # the labels of the document are unique, so they keep their ids
+        labels = document.labels
+        table.labels = LabelTable()
+        for label in labels:
+            table.labels.intern(label)
+        # the feats strings are stored as a column, like the other fields
+        table.columns = {
+            field: np.asarray(document.arrays[field], dtype=np.int32)
+            for field in WORD_FIELDS + ["feats"]
+        }
+        # the feats are parsed once per distinct feats string
+        feats_codes = np.asarray(document.arrays["feats"])
+        keys: Dict[str, np.ndarray] = {}
+        for code in np.unique(feats_codes[feats_codes >= 0]).tolist():
+            features = labels[code]
+            if features == "_":
+                continue
+            for pair in features.split("|"):
+                key, value = pair.split("=")
+                if key not in keys:
+                    keys[key] = np.full(len(labels) + 1, -1, dtype=np.int32)
+                keys[key][code] = table.labels.intern(value)
+        table.feats = {key: column[feats_codes] for key, column in keys.items()}
+        return table
+
+    def _words(self) -> List[Word]:
+        """Return the words of the document, if it still exists."""
+        document = self._source() if self._source is not None else None
+        if document is None:
+            return []
+        if isinstance(document, Sentence):
+            return list(document.words)
+        return [word for sentence in document.sentences for word in sentence.words]
+
+    def __len__(self) -> int:
+        """Return the number of words."""
+        return len(self.head)
+
+    @property
+    def num_sentences(self) -> int:
+        """Return the number of sentences."""
+        return len(self.sentence_offsets) - 1
+
+    def sentence(self, index: int) -> slice:
+        """Return the positions of the words of a sentence."""
+        return slice(self.sentence_offsets[index], self.sentence_offsets[index + 1])
+
+    def _numbers(self, attribute: str) -> Optional[np.ndarray]:
+        """Return the integer column of an attribute (head or id), if any."""
+        if attribute == "head":
+            return self.head
+        if attribute == "id":
+            return self.word_ids
+        return None
+
+    def ids(self, attribute: str) -> np.ndarray:
+        """
+        Return the ids of an attribute for all words.
+
+        Like _get_word_attribute, the attribute of the word is preferred and
+        the feats are used as fallback. The numbers of head and id are used as
+        labels.
+        """
+        numbers = self._numbers(attribute)
+        if numbers is not None:
+            intern = self.labels.intern
+            return np.array([intern(n) for n in numbers.tolist()], dtype=np.int32)
+        column = self.columns.get(attribute)
+        feats = self.feats.get(attribute)
+        if column is None:
+            if feats is not None:
+                return feats
+            words = self._words()
+            if words and hasattr(words[0], attribute):
+                # other attributes of the words (e.g., misc) are not stored
+                values = [getattr(word, attribute, None) for word in words]
+                return np.array(
+                    [-1 if v is None else self.labels.intern(v) for v in values],
+                    dtype=np.int32,
+                )
+            return np.full(len(self), -1, dtype=np.int32)
+        if feats is None:
+            return column
+        return np.where(column >= 0, column, feats)
+
+    def strings(
+        self, attribute: str, fallback: str = "_", positions: slice = slice(None)
+    ) -> List[Any]:
+        """
+        Return the values of an attribute for (some of) the words.
+
+        Args:
+            attribute: the name of the attribute (e.g., upos) or feature
+                (e.g., Number).
+            fallback: the value for words that don't have the attribute.
+            positions: the words to return, e.g. table.sentence(0).
+        """
+        numbers = self._numbers(attribute)
+        if numbers is not None:
+            return numbers[positions].tolist()
+        if attribute not in self.columns and attribute not in self.feats:
+            words = self._words()
+            if words and hasattr(words[0], attribute):
+                # other attributes of the words (e.g., misc) are not stored
+                return [
+                    _get_word_attribute(word, attribute, fallback)
+                    for word in words[positions]
+                ]
+        labels = self.labels.labels
+        return [
+            labels[i] if i >= 0 else fallback
+            for i in self.ids(attribute)[positions].tolist()
+        ]
+
+    def features(self) -> List[Dict[str, str]]:
+        """Return the feats of each word that has any, as dictionaries."""
+        labels = self.labels.labels
+        result: List[Dict[str, str]] = [{} for _ in range(len(self))]
+        for key, column in self.feats.items():
+            for position in np.flatnonzero(column >= 0).tolist():
+                result[position][key] = labels[column[position]]
+        return [features for features in result if features]
+
+
+_WORD_TABLES: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+class ColumnarDocument:
+    """
+    A parsed stanza document stored as columns of numbers.
+
+    Each word is represented by its position in the arrays of WORD_FIELDS,
+    feats, head and id, where the strings are stored as ids of the labels of
+    this document (-1 for missing values). The sentences are stored as
+    offsets into the word arrays, together with their number of tokens and
+    their text.
+
+    Columnar documents are saved as uncompressed npz files, which can be read
+    much faster than pickled stanza documents, and memory-mapped, so that
+    reading a single column does not load the others. All transformers of
+    this module accept them like stanza documents.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        """
+        Initialize the document.
+
+        Args:
+            arrays: the columns, as created by from_stanza.
+        """
+        self.arrays = arrays
+        self._labels: Optional[List[str]] = None
+
+    @classmethod
+    def from_stanza(cls, document: Document) -> ColumnarDocument:
+        """Convert a stanza document."""
+        labels = LabelTable()
+        sentences = document.sentences
+        words = [word for sentence in sentences for word in sentence.words]
+
+        def codes(values: Iterable[Optional[str]]) -> np.ndarray:
+            return np.array(
+                [-1 if v is None else labels.intern(v) for v in values], np.int32
+            )
+
+        arrays = {
+            field: codes(getattr(w, field, None) for w in words)
+            for field in WORD_FIELDS
+        }
+        arrays["feats"] = codes(word.feats for word in words)
+        arrays["head"] = np.array([word.head or 0 for word in words], np.int32)
+        arrays["id"] = np.array(
+            [
+                word.id if isinstance(word.id, int) else position
+                for sentence in sentences
+                for position, word in enumerate(sentence.words, start=1)
+            ],
+            np.int32,
+        )
+        lengths = [len(sentence.words) for sentence in sentences]
+        arrays["sentence_offsets"] = np.cumsum([0] + lengths, dtype=np.int64)
+        arrays["sentence_tokens"] = np.array(
+            [len(sentence.tokens) for sentence in sentences], np.int32
+        )
+        arrays["sentence_text"] = codes(sentence.text for sentence in sentences)
+        arrays["document_text"] = np.frombuffer(
+            (document.text or "").encode("utf-8"), dtype=np.uint8
+        )
+        encoded = [label.encode("utf-8") for label in labels.labels]
+        arrays["label_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        arrays["label_offsets"] = np.cumsum(
+            [0] + [len(label) for label in encoded], dtype=np.int64
+        )
+        return cls(arrays)
+
+    def save(self, path: str) -> None:
+        """Save the document as an uncompressed npz file."""
+        with open(path, "wb") as out_fh:
+            np.savez(out_fh, **self.arrays)  # type: ignore[arg-type]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> ColumnarDocument:
+        """
+        Load a document saved with save.
+
+        Args:
+            path: the npz file.
+            mmap: if true, the columns are memory-mapped instead of read.
+        """
+        if not mmap:
+            with np.load(path) as data:
+                return cls({name: data[name] for name in data.files})
+        return cls(_memmap_npz(path))
+
+    @property
+    def labels(self) -> List[str]:
+        """Return the strings of the ids used in this document."""
+        if self._labels is None:
+            data = bytes(self.arrays["label_data"])
+            offsets = self.arrays["label_offsets"].tolist()
+            self._labels = [
+                data[start:end].decode("utf-8")
+                for start, end in zip(offsets, offsets[1:])
+            ]
+        return self._labels
+
+    def strings(self, field: str) -> List[Optional[str]]:
+        """Return the values of a column of words or sentences as strings."""
+        labels = self.labels
+        return [labels[i] if i >= 0 else None for i in self.arrays[field].tolist()]
+
+    @property
+    def sentence_texts(self) -> List[str]:
+        """Return the text of each sentence, empty for sentences without text."""
+        return [text or "" for text in self.strings("sentence_text")]
+
+    @property
+    def text(self) -> str:
+        """Return the text of the document."""
+        return bytes(self.arrays["document_text"]).decode("utf-8")
+
+    @property
+    def num_words(self) -> int:
+        """Return the number of words."""
+        return len(self.arrays["head"])
+
+    @property
+    def num_tokens(self) -> int:
+        """Return the number of tokens."""
+        return int(self.arrays["sentence_tokens"].sum())
+
+    @property
+    def num_sentences(self) -> int:
+        """Return the number of sentences."""
+        return len(self.arrays["sentence_tokens"])
+
+
+AnyDocument = Union[Document, Sentence, ColumnarDocument]
+
+
+def _memmap_npz(path: str) -> Dict[str, np.ndarray]:
+    """
+    Memory-map the arrays of an uncompressed npz file.
+
+    The file is mapped once, and all arrays are views into this mapping. Since
+    python 3.13, the mapping doesn't keep a file descriptor open, before that
+    it keeps one per file.
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as in_fh:
+        kwargs = {"trackfd": False} if sys.version_info >= (3, 13) else {}
+        mapped = mmap.mmap(in_fh.fileno(), 0, access=mmap.ACCESS_READ, **kwargs)
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"can't memory-map compressed file: {path}")
+            # the local header has its own (variable) length
+            in_fh.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", in_fh.read(4))
+            in_fh.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(in_fh)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(in_fh)
+            else:
+                header = np.lib.format.read_array_header_2_0(in_fh)
+            shape, fortran_order, dtype = header
+            name = info.filename[: -len(".npy")]
+            arrays[name] = np.ndarray(
+                shape,
+                dtype=dtype,
+                buffer=mapped,
+                offset=in_fh.tell(),
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def save_document(document: Union[Document, ColumnarDocument], path: str) -> None:
+    """Save a parsed document, as columns if the path ends with .npz."""
+    if path.endswith(".npz"):
+        if not isinstance(document, ColumnarDocument):
+            document = ColumnarDocument.from_stanza(document)
+        document.save(path)
+    else:
+        with open(path, "wb") as out_fh:
+            pickle.dump(document, out_fh)
+
+
+def load_document(path: str, mmap: bool = False) -> Union[Document, ColumnarDocument]:
+    """
+    Load a document saved with save_document.
+
+    Args:
+        path: the file, a ColumnarDocument if it ends with .npz.
+        mmap: if true, columnar documents are memory-mapped, see
+            ColumnarDocument.load. Before python 3.13, each mapped document
+            keeps a file open, so this is not suited for loading whole corpora.
+    """
+    if path.endswith(".npz"):
+        return ColumnarDocument.load(path, mmap=mmap)
+    with open(path, "rb") as in_fh:
+        return pickle.load(in_fh)
 
 
 class StanzaWordFeatureFrequencyTransformer(BaseEstimator, TransformerMixin):
     """
     Return a frequency matrix for all features for each word of each document.
 
-    This transformer looks for the file resources/word_features.json, where all
-    possible values should be stored (unfortunately, stanfordnlp does not offer
-    a comprehensive list of possible values for each model).
+    The features (e.g., Number__Sing) are learned during fit. Optionally, a
+    JSON file containing a list of features can be used to seed them (e.g.,
+    WORD_FEATURES_JSON), since stanfordnlp does not offer a
+    comprehensive list of possible values for each model.
+
+    If this transformer encounters a feature not seen during fit, it is
+    counted in the column UNK.
 
-    If this transformer encounters an element not in that file, it will add one
+    Output: a sparse matrix (scipy CSR) with a row for each document and a
+    column for each feature, see get_feature_names.
     """
 
-    def __init__(self) -> None:
-        """Initialize class."""
+    def __init__(self, features_file: str = None) -> None:
+        """
+        Initialize class.
+
+        Args:
+            features_file: path to a JSON list of features that are always
+                part of the output, in this order.
+        """
         super().__init__()
-        with open(WORD_FEATURES_JSON) as i_fh:
-            self.features = json.load(i_fh)
-            self.features.append(UNKNOWN_KEY)  # for unknown keys
+        self.features_file = features_file
 
     def fit(
-        self, _x: Any, _y: Any = None, **_fit_kwargs: Any
+        self, x: Iterable[AnyDocument], _y: Any = None, **_fit_kwargs: Any
     ) -> StanzaWordFeatureFrequencyTransformer:
         """Fit the model."""
+        features: List[str] = []
+        if self.features_file:
+            with open(self.features_file) as i_fh:
+                features = [f for f in json.load(i_fh) if f != UNKNOWN_KEY]
+        known = set(features)
+        found = set()
+        for document in x:
+            table = WordTable.of(document)
+            for key, column in table.feats.items():
+                for value in np.unique(column[column >= 0]).tolist():
+                    found.add(f"{key}__{table.labels[value]}")
+        features += sorted(found - known)
+        features.append(UNKNOWN_KEY)  # for unknown keys
+        self.features_ = features
+        self.vocabulary_ = {feature: i for i, feature in enumerate(features)}
         return self
 
-    def transform(
-        self, x: Iterable[Document], _y: Iterable = None
-    ) -> List[Dict[str, int]]:
+    def required_fields(self) -> List[str]:
+        """Return the word fields read by this transformer."""
+        return ["feats"]
+
+    def get_feature_names(self) -> List[str]:
+        """Return the name of each column of the output."""
+        check_is_fitted(self, "features_")
+        return self.features_
+
+    def transform(self, x: Iterable[AnyDocument], _y: Iterable = None) -> csr_matrix:
         """Transform documents."""
-        result = []
+        check_is_fitted(self, "features_")
+        unknown_column = self.vocabulary_[UNKNOWN_KEY]
+        # maps (feature key, value) to the output column
+        columns: Dict[Tuple[str, str], int] = {}
+        unknown = set()
+        indices: List[int] = []
+        counts: List[int] = []
+        indptr = [0]
         for document in x:
-            doc = {}
-            for feature in self.features:
-                doc[feature] = 0
-            for features_dict in _get_features_per_word(document):
-                for k, v in features_dict.items():
-                    key = f"{k}__{v}"
-                    if key not in doc:
-                        key = UNKNOWN_KEY
-                        warnings.warn(f"key {key} not found during fit, returning UNK")
-                    doc[key] += 1
-            result.append(doc)
-        return result
+            table = WordTable.of(document)
+            for key, column in table.feats.items():
+                values, value_counts = np.unique(
+                    column[column >= 0], return_counts=True
+                )
+                for value_id, count in zip(values.tolist(), value_counts.tolist()):
+                    value = table.labels[value_id]
+                    index = columns.get((key, value))
+                    if index is None:
+                        feature = f"{key}__{value}"
+                        index = self.vocabulary_.get(feature, unknown_column)
+                        if index == unknown_column:
+                            unknown.add(feature)
+                        columns[(key, value)] = index
+                    indices.append(index)
+                    counts.append(count)
+            indptr.append(len(indices))
+        if unknown:
+            warnings.warn(
+                f"{len(unknown)} features not found during fit, counted as "
+                f"{UNKNOWN_KEY}, e.g.: {sorted(unknown)[:5]}"
+            )
+        matrix = csr_matrix(
+            (np.array(counts, dtype=np.int64), indices, indptr),
+            shape=(len(indptr) - 1, len(self.features_)),
+        )
+        matrix.sum_duplicates()
+        return matrix
 
 
 class StanzaNlpToFieldTransformer(BaseEstimator, TransformerMixin):
@@ -107,46 +1078,92 @@ class StanzaNlpToFieldTransformer(BaseEstimator, TransformerMixin):
     Flattens a stanford document in the same order as the parsed text.
 
     Input document:
-        each document is expected to be a StanfordNLP document.
+        each document is expected to be a StanfordNLP document (or a sentence
+        or ColumnarDocument).
     Output document: each document is returned as a list of sentences; and each sentence
         is a list of tags (=strings)
 
+    If several fields are requested, all of them are extracted in a single pass
+    and the output is a dictionary mapping each field to its documents (see
+    tuhlbox.tree.TreeViewSelector for selecting them in a pipeline).
+    With output="ids", each sentence is a numpy array of ids instead of a list
+    of strings. The ids of each field are learned during fit (see
+    vocabulary_), and -1 marks missing values and labels not seen during fit.
     """
 
-    def __init__(self, field: str):
+    def __init__(self, field: Union[str, List[str]], output: str = "strings"):
         """
         Initialize class.
 
         Args:
-            field: which part of a word (token) to use as representative.
+            field: which part of a word (token) to use as representative, or
+                a list of them.
+            output: either "strings" or "ids".
         """
+        valid_outputs = ["strings", "ids"]
+        if output not in valid_outputs:
+            raise ValueError(f"unknown output: {output}. valid values: {valid_outputs}")
         self.field = field
+        self.output = output
 
-    def fit(self, _x: Any, _y: Any = None) -> StanzaNlpToFieldTransformer:
+    def fit(
+        self, x: Iterable[Union[str, AnyDocument]], _y: Any = None
+    ) -> StanzaNlpToFieldTransformer:
         """Fit the model."""
+        if self.output != "ids":
+            return self
+        found: Dict[str, Set[str]] = {field: set() for field in self.required_fields()}
+        for document in x:
+            if isinstance(document, (Document, Sentence, ColumnarDocument)):
+                table = WordTable.of(document)
+                for field, labels in found.items():
+                    ids = table.ids(field)
+                    values = np.unique(ids[ids >= 0]).tolist()
+                    labels.update(table.labels[i] for i in values)
+        self.vocabulary_ = {
+            field: {label: i for i, label in enumerate(sorted(labels))}
+            for field, labels in found.items()
+        }
         return self
 
+    def required_fields(self) -> List[str]:
+        """Return the word fields read by this transformer."""
+        return [self.field] if isinstance(self.field, str) else list(self.field)
+
+    def _ids(self, table: WordTable, field: str) -> np.ndarray:
+        """Return the learned ids of a field for all words of a table."""
+        ids = table.ids(field)
+        vocabulary = self.vocabulary_[field]
+        # the last entry maps missing values (-1) to -1
+        remap = [vocabulary.get(label, -1) for label in table.labels.labels]
+        return np.array(remap + [-1], dtype=np.int32)[ids]
+
     def transform(
-        self, x: Iterable[Union[str, Document, Sentence]], _y: Any = None
-    ) -> List[List[List[str]]]:
+        self, x: Iterable[Union[str, AnyDocument]], _y: Any = None
+    ) -> Union[List[List[Any]], Dict[str, List[List[Any]]]]:
         """Transform documents."""
-        result: List[List[List[str]]] = []
+        fields = self.required_fields()
+        if self.output == "ids":
+            check_is_fitted(self, "vocabulary_")
+        result: Dict[str, List[List[Any]]] = {field: [] for field in fields}
         for document in x:
-            document_result: List[List[str]] = []
-            sentences: List[Sentence] = []
-            if isinstance(document, Sentence):
-                sentences = [document]
-            elif isinstance(document, Document):
-                sentences = document.sentences
-            for sentence in sentences:
-                new_sentence = []
-                for word in sentence.words:
-                    label = _get_word_attribute(word, self.field, fallback="_")
-                    if label is None:
-                        raise ValueError(f"label is None for word: {word}")
-                    new_sentence.append(label)
-                document_result.append(new_sentence)
-            result.append(document_result)
+            document_results: Dict[str, List[Any]] = {field: [] for field in fields}
+            if isinstance(document, (Document, Sentence, ColumnarDocument)):
+                table = WordTable.of(document)
+                for field in fields:
+                    values = (
+                        self._ids(table, field)
+                        if self.output == "ids"
+                        else table.strings(field, "_")
+                    )
+                    document_results[field] = [
+                        values[table.sentence(index)]
+                        for index in range(table.num_sentences)
+                    ]
+            for field in fields:
+                result[field].append(document_results[field])
+        if isinstance(self.field, str):
+            return result[self.field]
         return result
 
 
@@ -157,9 +1174,24 @@ class StanzaParserTransformer(BaseEstimator, TransformerMixin):
     This transformer takes text and parses it using the stanza python
     package, which uses theano and various neural models to parse different
     features from natural text.
+
+    The documents are passed to stanza in batches, so that its neural
+    processors work on the sentences of many documents at once.
     """
 
-    def __init__(self, language: str, silent: bool = False, cpu: bool = False):
+    def __init__(
+        self,
+        language: str,
+        silent: bool = False,
+        cpu: bool = False,
+        batch_size: int = 32,
+        log_file: str = None,
+        n_jobs: int = 1,
+        threads_per_job: int = 1,
+        cache_dir: str = None,
+        processors: Union[str, Dict[str, str]] = None,
+        token_budget: int = None,
+    ):
         """
         Initialize class.
 
@@ -168,30 +1200,120 @@ class StanzaParserTransformer(BaseEstimator, TransformerMixin):
             silent: if true, don't show a progress bar
             cpu: if true, use cpu instead of gpu. Useful for memory-intensive
                 parse tasks.
+            batch_size: the number of documents that are parsed together.
+            log_file: if set, each document is appended to this file before
+                it is parsed, which helps finding documents that crash the
+                parser.
+            n_jobs: if larger than 1, the batches are parsed by this many
+                worker processes, each with its own pipeline. The documents
+                are returned in input order.
+            threads_per_job: the number of torch threads of each worker. Only
+                used if n_jobs is larger than 1.
+            cache_dir: if set, parsed documents are stored in a ParseCache in
+                this directory, and texts that were parsed before are loaded
+                from there instead.
+            processors: the stanza processors to run (e.g., "tokenize,pos"),
+                None for the default processors of the language, or "auto".
+                "auto" is replaced by the processors that the following steps
+                need when resolve_processors is called on the pipeline.
+            token_budget: if set, the documents of each batch are split into
+                sentences first, and the sentences of all documents are parsed
+                in length-sorted groups of at most this many words. This
+                makes the memory usage independent of the document lengths.
+                Use a larger batch_size to sort over more documents.
         """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        if n_jobs < 1 or threads_per_job < 1:
+            raise ValueError(
+                f"n_jobs and threads_per_job must be positive, got {n_jobs} and "
+                f"{threads_per_job}"
+            )
+        if token_budget is not None and token_budget < 1:
+            raise ValueError(f"token_budget must be positive, got {token_budget}")
         self.language = language
         self.silent = silent
         self.cpu = cpu
+        self.batch_size = batch_size
+        self.log_file = log_file
+        self.n_jobs = n_jobs
+        self.threads_per_job = threads_per_job
+        self.cache_dir = cache_dir
+        self.processors = processors
+        self.token_budget = token_budget
         if cpu:
             logger.info("using CPU for stanford parsing")
             os.environ["CUDA_VISIBLE_DEVICES"] = ""
-        self.nlp = stanza.Pipeline(lang=self.language, use_gpu=not cpu)
+
+    @property
+    def nlp(self) -> stanza.Pipeline:
+        """
+        Return the stanza pipeline of this transformer.
+
+        The pipeline is loaded on first use and shared via the registry, so
+        clones and pickles of this transformer don't carry the model weights.
+        """
+        return get_pipeline(self.language, self._get_processors(), not self.cpu)
+
+    def _get_processors(self) -> Union[str, Dict[str, str], None]:
+        if self.processors == "auto":
+            warnings.warn(
+                'processors="auto" was not resolved, call resolve_processors on the '
+                "pipeline. Using the default processors."
+            )
+            return None
+        return self.processors
 
     def fit(self, _x: Any, _y: Any = None) -> StanzaParserTransformer:
         """Fit the model."""
         return self
 
+    def _batches(self, x: Iterable[str], log_fh: IO = None) -> Iterator[List[str]]:
+        """Split the documents into batches, logging each batch if requested."""
+        documents = iter(x)
+        while True:
+            batch = list(itertools.islice(documents, self.batch_size))
+            if not batch:
+                return
+            if log_fh:
+                log_fh.writelines(document + "\n" for document in batch)
+                log_fh.flush()
+            yield batch
+
     def transform(self, x: Iterable[str], _y: Any = None) -> List[Document]:
         """Transform documents."""
-        result = []
-        if self.silent:
-            pbar = x
-        else:
-            pbar = tqdm(x)
-        for document in pbar:
-            with open("/tmp/stanford_parsing", "a") as log_fh:
-                log_fh.write(document + "/n")
-                result.append(self.nlp(document))
+        result: List[Document] = []
+        pbar = None if self.silent else tqdm(total=_length_hint(x))
+        processors = self._get_processors()
+        with contextlib.ExitStack() as stack:
+            log_fh = None
+            if self.log_file:
+                log_fh = stack.enter_context(open(self.log_file, "a"))
+            tasks = (
+                ParseTask(
+                    self.language,
+                    processors,
+                    not self.cpu,
+                    batch,
+                    self.cache_dir,
+                    self.token_budget,
+                )
+                for batch in self._batches(x, log_fh)
+            )
+            parsed_batches: Iterable[List[Document]]
+            if self.n_jobs > 1:
+                pool = parsing_pool(self.n_jobs, self.threads_per_job)
+                stack.enter_context(pool)
+                # imap keeps the order of the batches
+                parsed_batches = pool.imap(parse_texts, tasks)
+            else:
+                parsed_batches = map(parse_texts, tasks)
+            for parsed in parsed_batches:
+                result += parsed
+                if pbar is not None:
+                    pbar.update(len(parsed))
+        if pbar is not None:
+            pbar.close()
         return result
 
 
@@ -202,7 +1324,8 @@ class StanzaToNltkTreesTransformer(BaseEstimator, TransformerMixin):
     This transformer takes documents created by the stanza python package
     and transforms them into dependency trees in nltk format.
 
-    Input: each document is either a stanza Document or Sentence.
+    Input: each document is either a stanza Document, Sentence or a
+        ColumnarDocument.
     Output: each document is a list of NLTK Trees, one for each sentence.
         If the input document is a sentence, than the result is a list with
         a single entry.
@@ -231,37 +1354,67 @@ class StanzaToNltkTreesTransformer(BaseEstimator, TransformerMixin):
         """Fit the model."""
         return self
 
+    def required_fields(self) -> List[str]:
+        """Return the word fields read by this transformer."""
+        return self.node_labels + ["head"]
+
     def transform(
-        self, x: Iterable[Union[Document, Sentence]], _y: Any = None
+        self, x: Iterable[AnyDocument], _y: Any = None
     ) -> List[List[nltk.Tree]]:
         """Transform documents."""
         result = []
         for document in x:
-            sentences = []
-            if isinstance(document, Document):
-                sentences = document.sentences
-            elif isinstance(document, Sentence):
-                sentences = [document]
             doc = []
-            for sentence in sentences:
-                dependency_tree = self.parse(sentence)
-                labeled_tree = self.get_symbols(dependency_tree)
-                doc.append(labeled_tree)
+            if isinstance(document, (Document, Sentence, ColumnarDocument)):
+                table = WordTable.of(document)
+                doc = [self._build(table, i) for i in range(table.num_sentences)]
             if not doc:
                 raise ValueError(f"coud not parse anything from input {document}")
             result.append(doc)
         return result
 
-    def get_symbols(self, tree: nltk.Tree) -> nltk.Tree:
-        """Extract the symbol from the dependency relationship."""
-        dependency = tree.label()
-        if isinstance(dependency, str):
-            return nltk.Tree(dependency, [self.get_symbols(c) for c in tree])
-            # root case
+    def _build(self, table: WordTable, index: int) -> nltk.Tree:
+        """
+        Construct the labeled tree of a sentence from the columns of a table.
+
+        This is equivalent to get_symbols(parse(sentence)), but the children of
+        each word are found with a single pass over the heads, and the labels
+        are read from the table.
+        """
+        positions = table.sentence(index)
+        relations = table.strings("deprel", "_", positions)
+        columns = [relations] if "dependency" in self.node_labels else []
+        columns += [
+            table.strings(label, "_", positions)
+            for label in self.node_labels
+            if label != "dependency"
+        ]
+        labels = ["#".join(parts) for parts in zip(*columns)]
+
+        # children[i] are the positions of the dependents of word i (1-based)
+        children: List[List[int]] = [[] for _ in range(len(relations) + 1)]
+        roots = []
+        heads = table.head[positions].tolist()
+        for position, (head, relation) in enumerate(zip(heads, relations), start=1):
+            if relation == "root":
+                # it is possible that multiple words have a root relationship
+                roots.append(position)
+            elif 0 < head < len(children):
+                children[head].append(position)
 
-        # the dependency consists of three parts:
+        tree = nltk.Tree("root", [])
+        stack = [(tree, position) for position in reversed(roots)]
+        while stack:
+            parent, position = stack.pop()
+            node = nltk.Tree(labels[position - 1], [])
+            parent.append(node)
+            stack.extend((node, child) for child in reversed(children[position]))
+        return tree
+
+    def _label(self, dependency: Tuple[Word, str, Word]) -> str:
+        """Create the label of a dependency (head, relationship, word)."""
+        # the head word is labeled by its own dependency
         _, relationship, word_2 = dependency
-        # the first word is already handled in other iterations of this method
         labels = []
         if "dependency" in self.node_labels:
             labels.append(relationship)
@@ -270,9 +1423,15 @@ class StanzaToNltkTreesTransformer(BaseEstimator, TransformerMixin):
             for label in self.node_labels
             if label != "dependency"
         ]
-        label = "#".join(labels)
-        result = nltk.Tree(label, [self.get_symbols(c) for c in tree])
-        return result
+        return "#".join(labels)
+
+    def get_symbols(self, tree: nltk.Tree) -> nltk.Tree:
+        """Extract the symbol from the dependency relationship."""
+        dependency = tree.label()
+        if isinstance(dependency, str):
+            # root case
+            return nltk.Tree(dependency, [self.get_symbols(c) for c in tree])
+        return nltk.Tree(self._label(dependency), [self.get_symbols(c) for c in tree])
 
     def get_nodes(self, tree: nltk.Tree) -> List[nltk.Tree]:
         """Extract the leaf nodes from a tree."""
@@ -286,29 +1445,35 @@ class StanzaToNltkTreesTransformer(BaseEstimator, TransformerMixin):
 
     def parse(self, sentence: Sentence) -> nltk.Tree:
         """Construct a NLTK tree from stanza dependencies."""
-        roots = [d for d in sentence.dependencies if d[1] == "root"]
-        unprocessed = [d for d in sentence.dependencies if d not in roots]
-        # it is possible that multiple words have a root relationship
-        tree = nltk.Tree("root", [nltk.Tree(x, []) for x in roots])
+        return self._assemble(sentence, lambda dependency: dependency)
 
-        while True:
-            changed = False
-            added_dependencies = []
-            nodes = self.get_nodes(tree)
-            for d in unprocessed:
-                for leaf in nodes:
-                    if hasattr(d[0], "id"):
-                        if leaf.label()[2].id == d[0].id:
-                            leaf.append(nltk.Tree(d, []))
-                            added_dependencies.append(d)
-                            changed = True
-                    elif hasattr(d[0], "index"):
-                        if leaf.label()[2].index == d[0].index:
-                            leaf.append(nltk.Tree(d, []))
-                            added_dependencies.append(d)
-                            changed = True
-            unprocessed = [x for x in unprocessed if x not in added_dependencies]
-            if len(unprocessed) == 0 or not changed:
-                break
+    @staticmethod
+    def _assemble(sentence: Sentence, label: Callable[[Any], Any]) -> nltk.Tree:
+        """
+        Construct a NLTK tree from stanza dependencies in a single pass.
+
+        The dependencies are indexed by their head word first, so the tree can
+        be grown from the root(s) without searching. Each node is labeled with
+        label(dependency), and the dependents of a word keep the order of
+        sentence.dependencies. Dependencies that are not connected to a root
+        are dropped.
+        """
+        dependents: Dict[Any, List[Tuple[Word, str, Word]]] = {}
+        roots = []
+        for dependency in sentence.dependencies:
+            if dependency[1] == "root":
+                # it is possible that multiple words have a root relationship
+                roots.append(dependency)
+            else:
+                dependents.setdefault(_word_key(dependency[0]), []).append(dependency)
 
+        tree = nltk.Tree("root", [])
+        stack = [(tree, dependency) for dependency in reversed(roots)]
+        while stack:
+            parent, dependency = stack.pop()
+            node = nltk.Tree(label(dependency), [])
+            parent.append(node)
+            # popping the dependents ensures that each word is expanded once
+            children = dependents.pop(_word_key(dependency[2]), [])
+            stack.extend((node, child) for child in reversed(children))
         return tree
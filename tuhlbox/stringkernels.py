@@ -21,7 +21,8 @@ def _multiset_kernel(
     You probably don't want to use this method outside of this file.
 
     Args:
-        x, y: a numpy array of documents
+        x, y: a numpy array of documents, each being an iterable of features
+            or a Counter of them
         callback: one of the kernel methods in this file
         **callback_kwargs: optional arguments to the callback
 
@@ -29,8 +30,9 @@ def _multiset_kernel(
         a len(x) by len(y) matrix containing the kernel distances.
     """
     result = np.zeros((len(x), len(y)))
-    x_counts: List[Dict] = [Counter(d) for d in x]
-    y_counts: List[Dict] = [Counter(d) for d in y]
+    # documents may already be counted (e.g., by tree.PqGramTransformer)
+    x_counts: List[Dict] = [d if isinstance(d, Counter) else Counter(d) for d in x]
+    y_counts: List[Dict] = [d if isinstance(d, Counter) else Counter(d) for d in y]
     for i, xc in enumerate(x_counts):
         for j, yc in enumerate(y_counts):
             result[i, j] = callback(xc, yc)
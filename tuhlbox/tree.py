@@ -1,28 +1,519 @@
-"""Transformers working on NLTK tree objects."""
+"""Transformers working on NLTK tree objects or their compact ArrayTree form."""
 from __future__ import annotations
 
-from typing import Any, List, Union
+import struct
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
 
 import nltk
 import numpy as np
+from scipy.sparse import csr_matrix
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import murmurhash3_32
+
+
+def _tokenize_bracketed(string: str) -> List[str]:
+    """Split a bracketed tree string into brackets, labels and leaves."""
+    return string.replace("(", " ( ").replace(")", " ) ").split()
+
+
+def _malformed(string: str, reason: str) -> ValueError:
+    return ValueError(f"malformed tree string ({reason}): {string[:100]}")
+
+
+def _parse_bracketed(string: str) -> Tuple[List[str], List[int], List[bool]]:
+    """
+    Parse a bracketed tree string into flat lists, without recursion.
+
+    Returns:
+        the labels, parent indices and leaf flags of all nodes in pre-order.
+        The parent of the root node is -1.
+    """
+    tokens = _tokenize_bracketed(string)
+    labels: List[str] = []
+    parents: List[int] = []
+    is_leaf: List[bool] = []
+    # indices of all nodes that are not closed yet
+    stack: List[int] = []
+    i = 0
+    n = len(tokens)
+    while i < n:
+        token = tokens[i]
+        if token == "(":
+            if labels and not stack:
+                raise _malformed(string, "more than one tree")
+            label = ""
+            if i + 1 < n and tokens[i + 1] != "(" and tokens[i + 1] != ")":
+                i += 1
+                label = tokens[i]
+            parents.append(stack[-1] if stack else -1)
+            stack.append(len(labels))
+            labels.append(label)
+            is_leaf.append(False)
+        elif token == ")":
+            if not stack:
+                raise _malformed(string, "unexpected closing bracket")
+            stack.pop()
+        else:
+            if not stack:
+                raise _malformed(string, "leaf outside of brackets")
+            parents.append(stack[-1])
+            labels.append(token)
+            is_leaf.append(True)
+        i += 1
+    if stack:
+        raise _malformed(string, "missing closing bracket")
+    if not labels:
+        raise _malformed(string, "no tree found")
+    return labels, parents, is_leaf
+
+
+def _build_nltk_tree(
+    labels: List[str], parents: List[int], is_leaf: List[bool]
+) -> nltk.Tree:
+    """Build an nltk.Tree from flat lists of nodes in pre-order."""
+    nodes: List[Any] = [
+        label if leaf else nltk.Tree(label, []) for label, leaf in zip(labels, is_leaf)
+    ]
+    # in pre-order, the children of each node appear in their original order
+    for node, parent in zip(nodes[1:], parents[1:]):
+        nodes[parent].append(node)
+    return nodes[0]
+
+
+def parse_bracketed_tree(string: str) -> nltk.Tree:
+    """
+    Parse a bracketed tree string like "(S (NP I) (VP (V saw) (NP him)))".
+
+    This produces the same trees as nltk.Tree.fromstring with its default
+    arguments, but tokenizes the string once with plain string operations
+    instead of regular expressions, and builds the tree iteratively.
+
+    Args:
+        string: the tree in bracketed notation.
+
+    Returns:
+        the parsed tree.
+    """
+    return _build_nltk_tree(*_parse_bracketed(string))
+
+
+class LabelTable:
+    """Interns the labels of array trees, mapping each label to an integer id."""
+
+    def __init__(self) -> None:
+        """Initialize an empty table."""
+        self.ids: Dict[str, int] = {}
+        self.labels: List[str] = []
+
+    def intern(self, label: str) -> int:
+        """Return the id of a label, adding it to the table if necessary."""
+        label_id = self.ids.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self.ids[label] = label_id
+            self.labels.append(label)
+        return label_id
+
+    def __getitem__(self, label_id: int) -> str:
+        """Return the label of an id."""
+        return self.labels[label_id]
+
+    def __len__(self) -> int:
+        """Return the number of distinct labels."""
+        return len(self.labels)
+
+
+class ArrayTree:
+    """
+    Compact tree representation based on flat numpy arrays.
+
+    All nodes, including the leaves (words), are numbered in pre-order, so
+    that the root node has index 0 and each node's parent has a smaller index
+    than the node itself. Labels are stored as ids of a LabelTable, which is
+    usually shared by all trees of a corpus.
+
+    Attributes:
+        labels: label id of each node.
+        parents: index of the parent of each node, -1 for the root.
+        is_leaf: whether a node is a leaf (a string in nltk trees).
+            Nodes without children that are not leaves correspond to empty
+            nltk trees like "(X )".
+        child_offsets: the children of node i are
+            children[child_offsets[i]:child_offsets[i + 1]], in order.
+        children: node indices, grouped by parent.
+        label_table: the table that maps the label ids to strings.
+    """
+
+    __slots__ = (
+        "labels",
+        "parents",
+        "is_leaf",
+        "child_offsets",
+        "children",
+        "label_table",
+    )
+
+    def __init__(
+        self,
+        labels: Union[List[int], np.ndarray],
+        parents: Union[List[int], np.ndarray],
+        is_leaf: Union[List[bool], np.ndarray],
+        label_table: LabelTable,
+    ):
+        """
+        Initialize the tree.
+
+        Args:
+            labels: label id of each node, in pre-order.
+            parents: parent index of each node, in pre-order.
+            is_leaf: leaf flag of each node, in pre-order.
+            label_table: the table containing all label ids.
+        """
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.parents = np.asarray(parents, dtype=np.int32)
+        self.is_leaf = np.asarray(is_leaf, dtype=bool)
+        self.label_table = label_table
+        # a stable sort by parent keeps the siblings in pre-order
+        self.children = np.argsort(self.parents[1:], kind="stable").astype(np.int32)
+        self.children += 1
+        counts = np.bincount(self.parents[1:], minlength=len(self.labels))
+        self.child_offsets = np.zeros(len(self.labels) + 1, dtype=np.int32)
+        np.cumsum(counts, out=self.child_offsets[1:])
+
+    @classmethod
+    def fromstring(cls, string: str, label_table: LabelTable = None) -> ArrayTree:
+        """Parse a bracketed tree string, see parse_bracketed_tree."""
+        if label_table is None:
+            label_table = LabelTable()
+        labels, parents, is_leaf = _parse_bracketed(string)
+        label_ids = [label_table.intern(label) for label in labels]
+        return cls(label_ids, parents, is_leaf, label_table)
+
+    @classmethod
+    def from_nltk(cls, tree: nltk.Tree, label_table: LabelTable = None) -> ArrayTree:
+        """Convert an nltk.Tree into an ArrayTree."""
+        if label_table is None:
+            label_table = LabelTable()
+        labels: List[int] = []
+        parents: List[int] = []
+        is_leaf: List[bool] = []
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(labels)
+            parents.append(parent)
+            if isinstance(node, nltk.Tree):
+                labels.append(label_table.intern(node.label()))
+                is_leaf.append(False)
+                stack.extend((child, index) for child in reversed(node))
+            else:
+                labels.append(label_table.intern(node))
+                is_leaf.append(True)
+        return cls(labels, parents, is_leaf, label_table)
+
+    def to_nltk(self) -> nltk.Tree:
+        """Convert this tree into an nltk.Tree."""
+        table = self.label_table.labels
+        labels = [table[label_id] for label_id in self.labels.tolist()]
+        return _build_nltk_tree(labels, self.parents.tolist(), self.is_leaf.tolist())
+
+    def __len__(self) -> int:
+        """Return the number of nodes, including leaves."""
+        return len(self.labels)
+
+    def __eq__(self, other: Any) -> bool:
+        """Compare the structure and label strings of two trees."""
+        if not isinstance(other, ArrayTree):
+            return NotImplemented
+        return (
+            np.array_equal(self.parents, other.parents)
+            and np.array_equal(self.is_leaf, other.is_leaf)
+            and self.get_labels() == other.get_labels()
+        )
+
+    def __repr__(self) -> str:
+        """Return the bracketed representation of this tree."""
+        return f"ArrayTree({self.to_string()})"
+
+    def to_string(self) -> str:
+        """Return the bracketed representation, like nltk.Tree.pformat."""
+        return tree_to_string(self)
+
+    def label(self, node: int = 0) -> str:
+        """Return the label of a node, by default of the root node."""
+        return self.label_table[self.labels[node]]
+
+    def get_labels(self) -> List[str]:
+        """Return the labels of all nodes in pre-order."""
+        table = self.label_table.labels
+        return [table[label_id] for label_id in self.labels.tolist()]
+
+    def get_children(self, node: int) -> np.ndarray:
+        """Return the indices of the children of a node."""
+        return self.children[self.child_offsets[node] : self.child_offsets[node + 1]]
+
+    def get_child_counts(self) -> np.ndarray:
+        """Return the number of children of each node."""
+        return np.diff(self.child_offsets)
+
+    def get_depths(self) -> np.ndarray:
+        """Return the depth of each node, where the root has depth 0."""
+        return np.array(self._depth_list(), dtype=np.int32)
+
+    def _depth_list(self) -> List[int]:
+        parents = self.parents.tolist()
+        depths = [0] * len(parents)
+        # a single pass suffices, as each parent precedes its children
+        for node in range(1, len(parents)):
+            depths[node] = depths[parents[node]] + 1
+        return depths
+
+    def height(self) -> int:
+        """Return the height of the tree, as defined by nltk.Tree.height."""
+        return max(self._depth_list()) + 1
+
+    def leaves(self) -> List[str]:
+        """Return the leaves (words) of the tree from left to right."""
+        table = self.label_table.labels
+        return [table[label_id] for label_id in self.labels[self.is_leaf].tolist()]
+
+    def pos(self) -> List[Tuple[str, str]]:
+        """Return (leaf, parent label) pairs, like nltk.Tree.pos."""
+        table = self.label_table.labels
+        leaves = np.flatnonzero(self.is_leaf)
+        words = self.labels[leaves].tolist()
+        tags = self.labels[self.parents[leaves]].tolist()
+        return [(table[w], table[t]) for w, t in zip(words, tags)]
+
+
+AnyTree = Union[nltk.Tree, ArrayTree]
+
+
+Node = Tuple[int, str, bool, int]
+
+
+def _iter_nodes(tree: AnyTree) -> Iterator[Node]:
+    """
+    Iterate over all nodes of a tree in pre-order, without recursion.
+
+    Returns:
+        an iterator over (depth, label, is_leaf, number of children) of each
+        node, where leaves are the children of nltk trees that are not trees
+        themselves (usually strings).
+    """
+    if isinstance(tree, ArrayTree):
+        yield from zip(
+            tree._depth_list(),
+            tree.get_labels(),
+            tree.is_leaf.tolist(),
+            tree.get_child_counts().tolist(),
+        )
+        return
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if isinstance(node, nltk.Tree):
+            yield depth, node.label(), False, len(node)
+            stack.extend((child, depth + 1) for child in reversed(node))
+        else:
+            yield depth, node, True, 0
+
+
+def _pos_from_nodes(nodes: Iterable[Node]) -> List[str]:
+    """Return the parent labels of all leaves, like nltk.Tree.pos."""
+    path: List[str] = []  # labels from the root to the current node
+    tags = []
+    for depth, label, is_leaf, _ in nodes:
+        del path[depth:]
+        if is_leaf:
+            tags.append(path[-1])
+        else:
+            path.append(label)
+    return tags
+
+
+_CLOSE_BRACKET = object()
+_SPACE = object()
+
+
+def _format_label(label: Any) -> str:
+    return label if isinstance(label, str) else repr(label)
+
+
+def tree_to_string(tree: AnyTree) -> str:
+    """
+    Convert a tree into its bracketed representation on a single line.
+
+    The result is the same as nltk.Tree.pformat for lines that fit into the
+    margin, but it is written without recursion into a single buffer.
+    """
+    parts: List[str] = []
+    if isinstance(tree, ArrayTree):
+        open_nodes = 0  # number of brackets that are not closed yet
+        just_opened = False
+        for index, (depth, label, is_leaf, _) in enumerate(_iter_nodes(tree)):
+            closing = open_nodes - depth
+            if closing:
+                parts.append(")" * closing)
+                open_nodes = depth
+            # the first child of a node directly follows the opened bracket
+            if index and (closing or not just_opened):
+                parts.append(" ")
+            if is_leaf:
+                parts.append(label)
+            else:
+                parts.append(f"({label} ")
+                open_nodes += 1
+            just_opened = not is_leaf
+        parts.append(")" * open_nodes)
+        return "".join(parts)
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is _SPACE:
+            parts.append(" ")
+        elif node is _CLOSE_BRACKET:
+            parts.append(")")
+        elif isinstance(node, nltk.Tree):
+            parts.append(f"({_format_label(node.label())} ")
+            stack.append(_CLOSE_BRACKET)
+            for i, child in enumerate(reversed(node)):
+                if i:
+                    stack.append(_SPACE)
+                stack.append(child)
+        elif isinstance(node, tuple):
+            parts.append("/".join(node))
+        else:
+            parts.append(_format_label(node))
+    return "".join(parts)
+
+
+# magic bytes, size of integers, number of nodes and length of the labels
+_BINARY_HEADER = struct.Struct("<4sBII")
+_BINARY_MAGIC = b"TBT1"
+
+
+def tree_to_bytes(tree: AnyTree) -> bytes:
+    """
+    Convert a tree into a compact binary representation.
+
+    The format consists of a header, the distinct labels of the tree
+    (separated by null bytes), the label index and parent index (+1) of each
+    node in pre-order and a bit mask marking the leaves. The indices use the
+    smallest unsigned integer type that fits the tree. The result can be read
+    with tree_from_bytes or StringToTreeTransformer.
+    """
+    if isinstance(tree, ArrayTree):
+        label_ids, local_ids = np.unique(tree.labels, return_inverse=True)
+        labels = [tree.label_table[label_id] for label_id in label_ids.tolist()]
+        parents = tree.parents
+        is_leaf = tree.is_leaf
+    else:
+        local_table = LabelTable()
+        local_id_list = []
+        parent_list = []
+        leaf_list = []
+        # the last node seen on each depth, which is the parent of the next
+        # node one level deeper
+        last_nodes: List[int] = []
+        for index, (depth, label, leaf, _) in enumerate(_iter_nodes(tree)):
+            del last_nodes[depth:]
+            parent_list.append(last_nodes[-1] if last_nodes else -1)
+            last_nodes.append(index)
+            local_id_list.append(local_table.intern(label))
+            leaf_list.append(leaf)
+        labels = local_table.labels
+        local_ids = np.array(local_id_list)
+        parents = np.array(parent_list)
+        is_leaf = np.array(leaf_list, dtype=bool)
+    num_nodes = len(local_ids)
+    # all indices are smaller than the number of nodes
+    itemsize = 1 if num_nodes <= 0xFF else 2 if num_nodes <= 0xFFFF else 4
+    dtype = f"<u{itemsize}"
+    label_block = "\0".join(labels).encode("utf-8")
+    return b"".join(
+        [
+            _BINARY_HEADER.pack(_BINARY_MAGIC, itemsize, num_nodes, len(label_block)),
+            label_block,
+            local_ids.astype(dtype).tobytes(),
+            (parents + 1).astype(dtype).tobytes(),
+            np.packbits(is_leaf).tobytes(),
+        ]
+    )
+
+
+def tree_from_bytes(
+    data: bytes, output: str = "nltk", label_table: LabelTable = None
+) -> AnyTree:
+    """
+    Read a tree written by tree_to_bytes.
+
+    Args:
+        data: the binary representation of the tree.
+        output: either "nltk" or "array", see StringToTreeTransformer.
+        label_table: the label table of array trees.
+
+    Returns:
+        the tree.
+    """
+    magic, itemsize, num_nodes, label_length = _BINARY_HEADER.unpack_from(data)
+    if magic != _BINARY_MAGIC:
+        raise ValueError(f"not a binary tree representation: {data[:20]!r}")
+    dtype = f"<u{itemsize}"
+    offset = _BINARY_HEADER.size
+    labels = data[offset : offset + label_length].decode("utf-8").split("\0")
+    offset += label_length
+    local_ids = np.frombuffer(data, dtype, num_nodes, offset)
+    offset += itemsize * num_nodes
+    parents = np.frombuffer(data, dtype, num_nodes, offset).astype(np.int32) - 1
+    offset += itemsize * num_nodes
+    leaf_bits = np.frombuffer(data, np.uint8, (num_nodes + 7) // 8, offset)
+    is_leaf = np.unpackbits(leaf_bits, count=num_nodes).astype(bool)
+    if output == "array":
+        if label_table is None:
+            label_table = LabelTable()
+        label_ids = np.array([label_table.intern(label) for label in labels])
+        return ArrayTree(label_ids[local_ids], parents, is_leaf, label_table)
+    return _build_nltk_tree(
+        [labels[i] for i in local_ids.tolist()], parents.tolist(), is_leaf.tolist()
+    )
 
 
 class StringToTreeTransformer(BaseEstimator, TransformerMixin):
     """
     Parses tree representations into their nltk.Tree object form.
 
-    input: list of list of strings
-    output: list of list of nltk.Tree objects
+    input: list of list of strings (bracketed trees) or bytes (written by
+        tree_to_bytes)
+    output: list of list of nltk.Tree objects (or ArrayTree objects)
     """
 
+    def __init__(self, output: str = "nltk"):
+        """
+        Initialize the transformer.
+
+        Args:
+            output: either "nltk" to produce nltk.Tree objects, or "array" to
+                produce ArrayTree objects. All array trees produced by one
+                call to transform share a single label table.
+        """
+        valid_outputs = ["nltk", "array"]
+        if output not in valid_outputs:
+            raise ValueError(f"unknown output: {output}. valid values: {valid_outputs}")
+        self.output = output
+
     def fit(self, _x: Any, _y: Any = None) -> StringToTreeTransformer:
         """Fit the model."""
         return self
 
-    def transform(self, x: List[List[str]], _y: Any = None) -> List[List[nltk.Tree]]:
+    def transform(
+        self, x: List[List[Union[str, bytes]]], _y: Any = None
+    ) -> List[List[AnyTree]]:
         """Transform the data."""
         result = []
+        label_table = LabelTable()
         for document in x:
             ret = []
             if isinstance(document, str):
@@ -32,8 +523,14 @@ class StringToTreeTransformer(BaseEstimator, TransformerMixin):
                     "splitter before (e.g., by using stanfordnlp)"
                 )
             for line in document:
-                if line and line.strip():
-                    tree = nltk.Tree.fromstring(line)
+                if isinstance(line, bytes):
+                    ret.append(tree_from_bytes(line, self.output, label_table))
+                elif line and line.strip():
+                    tree: AnyTree
+                    if self.output == "array":
+                        tree = ArrayTree.fromstring(line, label_table)
+                    else:
+                        tree = parse_bracketed_tree(line)
                     ret.append(tree)
             result.append(ret)
         return result
@@ -43,7 +540,7 @@ class WordToPosTransformer(BaseEstimator, TransformerMixin):
     """
     Creates a POS-only representation of a tree sentence.
 
-    input: list of list of trees
+    input: list of list of trees (nltk.Tree or ArrayTree)
     output: list of list of strings
     """
 
@@ -51,7 +548,7 @@ class WordToPosTransformer(BaseEstimator, TransformerMixin):
         """Fit the model."""
         return self
 
-    def transform(self, x: List[List[nltk.Tree]], _y: Any = None) -> List[List[str]]:
+    def transform(self, x: List[List[AnyTree]], _y: Any = None) -> List[List[str]]:
         """Transform the data."""
         ret = []
         for document in x:
@@ -62,6 +559,10 @@ class WordToPosTransformer(BaseEstimator, TransformerMixin):
         return ret
 
 
+# the chains of each tree of each document
+ChainDocuments = Iterable[List[Iterable[List[str]]]]
+
+
 class TreeChainTransformer(BaseEstimator, TransformerMixin):
     """
     Create chains of strings with an optional max length from tree structures.
@@ -72,14 +573,13 @@ class TreeChainTransformer(BaseEstimator, TransformerMixin):
     For example, in the tree (1 (2 (3, 4))) and max_lenth=2, the subchain 1-2
     is only returned once, although it is part of both chains 1-2-3 and 1-2-4.
 
-    input document: list of nltk.Tree objects (one for each sentence)
+    input document: list of nltk.Tree or ArrayTree objects (one for each
+    sentence)
 
     output document: the format of the output documents depend on the
-    combination parameters.
-
-
-
-
+    combination parameters. If count_chains is set, each document is a
+    Counter of its chains instead, and if n_features is set, the output is a
+    sparse matrix of (hashed) chain counts.
     """
 
     def __init__(
@@ -88,6 +588,8 @@ class TreeChainTransformer(BaseEstimator, TransformerMixin):
         combine_chain_elements: str = None,
         combine_chains: str = None,
         combine_strings: str = None,
+        n_features: int = None,
+        count_chains: bool = False,
     ):
         """
         Initialize class.
@@ -111,7 +613,37 @@ class TreeChainTransformer(BaseEstimator, TransformerMixin):
         combine_strings (str|None): if set, it will be used to join the tree
                 chains together to a single string per document. The parameter
                 is used to join the chains. Defaults to None.
+
+        n_features (int|None): if set, each chain is hashed into one of
+                n_features columns, and transform returns a sparse matrix
+                (scipy CSR) holding the chain counts of each document. This
+                can't be used together with the combine_* parameters.
+                Defaults to None.
+
+        count_chains (bool): if set, each document is returned as a Counter
+                of its chains, aggregated over all trees of the document.
+                The chains are tuples, or strings if combine_chain_elements
+                is set. Equal chains share a single key object across all
+                documents of a transform call. This can't be used together
+                with combine_chains and combine_strings, or with n_features.
+                Defaults to False.
         """
+        if count_chains and (
+            combine_chains is not None
+            or combine_strings is not None
+            or n_features is not None
+        ):
+            raise ValueError(
+                "count_chains can't be used with combine_chains, combine_strings "
+                "or n_features."
+            )
+        if n_features is not None and any(
+            x is not None
+            for x in [combine_chain_elements, combine_chains, combine_strings]
+        ):
+            raise ValueError("n_features can't be used with combine_* parameters.")
+        if n_features is not None and n_features < 1:
+            raise ValueError(f"n_features must be positive, got {n_features}")
         if combine_strings is not None and combine_chains is None:
             raise ValueError(
                 "if combine_strings is set, both combine_chains and "
@@ -126,47 +658,157 @@ class TreeChainTransformer(BaseEstimator, TransformerMixin):
         self.combine_chain_elements = combine_chain_elements
         self.combine_chains = combine_chains
         self.combine_strings = combine_strings
+        self.n_features = n_features
+        self.count_chains = count_chains
 
     def fit(self, _x: Any, _y: Any = None) -> TreeChainTransformer:
         """Fit the model."""
         return self
 
-    # please be careful, it is dangerous in here!
-    def _find_chains(self, tree: nltk.Tree, prev_labels: List[str]) -> List[List[str]]:
-        ret_full = []
-        if isinstance(tree, str) or len(tree) == 0:
-            # the leaf nodes of nltk trees are strings
-            if not self.max_length or len(prev_labels) < self.max_length:
-                ret_full.append(prev_labels[:])
-            return ret_full
-        if self.max_length and len(prev_labels) == self.max_length:
-            # case: intermediary subchain that stops before the root
-            prev_labels = prev_labels[1:]
-
-        prev_labels.append(tree.label())
-        if len(prev_labels) == self.max_length:
-            # by adding this node, we have completed a subchain
-            ret_full.append(prev_labels[:])
-        for child in tree:
-            ret_full += self._find_chains(child, prev_labels[:])
-        return ret_full
+    def _find_chains(self, tree: AnyTree) -> List[List[str]]:
+        """
+        Return all (sub)chains of a tree.
+
+        nltk trees are walked directly, with an explicit stack holding an
+        iterator over the remaining children of each node on the current path.
+        This is faster than going through _iter_nodes, and leaves are handled
+        without being pushed onto the stack.
+        """
+        if isinstance(tree, ArrayTree):
+            return self._chains_from_array(tree)
+        max_length = self.max_length
+        chains = []
+        path: List[str] = []  # labels from the root to the current node
+        stack = [iter([tree])]
+        while stack:
+            depth = len(stack) - 1
+            for node in stack[-1]:
+                if isinstance(node, nltk.Tree) and len(node):
+                    path[depth:] = [node.label()]
+                    if max_length and depth + 1 >= max_length:
+                        # by adding this node, we have completed a subchain
+                        chains.append(path[depth + 1 - max_length :])
+                    stack.append(iter(node))
+                    break
+                if not max_length or depth < max_length:
+                    # the leaf nodes of nltk trees are strings
+                    chains.append(path[:depth])
+            else:
+                stack.pop()
+        return chains
+
+    def _chains_from_array(self, tree: ArrayTree) -> List[List[str]]:
+        """Return all (sub)chains of an array tree, see _chains_from_nodes."""
+        max_length = self.max_length
+        chains = []
+        path: List[str] = []
+        # leaves and nodes without children end a chain
+        ends = (tree.is_leaf | (tree.get_child_counts() == 0)).tolist()
+        for depth, label, end in zip(tree._depth_list(), tree.get_labels(), ends):
+            if end:
+                if not max_length or depth < max_length:
+                    chains.append(path[:depth])
+            else:
+                path[depth:] = [label]
+                if max_length and depth + 1 >= max_length:
+                    chains.append(path[depth + 1 - max_length :])
+        return chains
+
+    def _chains_from_nodes(self, nodes: Iterable[Node]) -> List[List[str]]:
+        """
+        Return all (sub)chains of a tree, given its nodes in pre-order.
+
+        The labels from the root to the current node are kept on a single
+        shared stack. Leaves and nodes without children yield their full path
+        if it is shorter than max_length, inner nodes yield the window of the
+        last max_length labels once that window is complete.
+        """
+        max_length = self.max_length
+        chains = []
+        path: List[str] = []
+        for depth, label, is_leaf, num_children in nodes:
+            if is_leaf or num_children == 0:
+                if not max_length or depth < max_length:
+                    chains.append(path[:depth])
+            else:
+                path[depth:] = [label]
+                if max_length and depth + 1 >= max_length:
+                    chains.append(path[depth + 1 - max_length :])
+        return chains
+
+    def _count_hashed(self, documents: ChainDocuments) -> csr_matrix:
+        """Count the hashed chains of each document."""
+        n_features = self.n_features
+        # chains repeat a lot, so each distinct chain is only hashed once
+        columns: Dict[Tuple[str, ...], int] = {}
+        indices: List[int] = []
+        indptr = [0]
+        for document in documents:
+            for chains in document:
+                for chain in chains:
+                    key = tuple(chain)
+                    column = columns.get(key)
+                    if column is None:
+                        # labels are joined by the (non-printable) unit separator
+                        column = murmurhash3_32("\x1f".join(key), positive=True)
+                        column %= n_features
+                        columns[key] = column
+                    indices.append(column)
+            indptr.append(len(indices))
+        matrix = csr_matrix(
+            (np.ones(len(indices), dtype=np.int64), indices, indptr),
+            shape=(len(indptr) - 1, n_features),
+        )
+        matrix.sum_duplicates()
+        return matrix
+
+    def _count(self, documents: ChainDocuments) -> List[Counter]:
+        """Count the chains of each document."""
+        join = self.combine_chain_elements
+        keys: Dict[Tuple[str, ...], Any] = {}
+        result = []
+        for document in documents:
+            counter: Counter = Counter()
+            for chains in document:
+                for chain in chains:
+                    key = tuple(chain)
+                    shared_key = keys.get(key)
+                    if shared_key is None:
+                        shared_key = key if join is None else join.join(key)
+                        keys[key] = shared_key
+                    counter[shared_key] += 1
+            result.append(counter)
+        return result
 
     def transform(
-        self, documents: List[List[nltk.Tree]], _y: Any = None
-    ) -> Union[List[str], List[List[str]]]:
+        self, documents: List[List[AnyTree]], _y: Any = None
+    ) -> Union[List[str], List[List[str]], List[Counter], csr_matrix]:
         """Transform the data."""
+        #  a document consists of a list of nltk.Tree objects
+        #  one tree represents one sentence.
+        return self._combine(
+            [self._find_chains(tree) for tree in document] for document in documents
+        )
+
+    def _combine(
+        self, documents: ChainDocuments
+    ) -> Union[List[str], List[List[str]], List[Counter], csr_matrix]:
+        """Bring the chains of each tree of each document into output format."""
+        if self.n_features is not None:
+            return self._count_hashed(documents)
+        if self.count_chains:
+            return self._count(documents)
         result = []
         for document in documents:
-            #  a document consists of a list of nltk.Tree objects
-            #  one tree represents one sentence.
             new_document: Any = []
-            for tree in document:
+            for tree_chains in document:
                 #  every tree is split into a list of chains, whereas
                 #  every chain is a list of symbols.
-                chains: Any = self._find_chains(tree, [])
-
+                chains: Any
                 if self.combine_chain_elements is not None:
-                    chains = [self.combine_chain_elements.join(x) for x in chains]
+                    chains = [self.combine_chain_elements.join(x) for x in tree_chains]
+                else:
+                    chains = list(tree_chains)
                 if self.combine_chains is not None:
                     new_document.append(self.combine_chains.join(chains))
                 else:
@@ -178,51 +820,57 @@ class TreeChainTransformer(BaseEstimator, TransformerMixin):
         return result
 
 
-def _get_average_height(document: List[nltk.Tree]) -> float:
-    """Calculate the average height of all trees in a document."""
-    return np.average([tree.height() for tree in document])
-
-
-def _calculate_average_children(tree: nltk.Tree) -> List[int]:
-    result = []
-    if type(tree) != nltk.tree.Tree or not tree:
-        result.append(0)
-    else:
-        result.append(len(tree))
-        for child in tree:
-            result += _calculate_average_children(child)
-    return result
+TreeCounts = Tuple[int, int, int, int]
 
 
-def _get_average_children(document: List[nltk.Tree]) -> float:
-    result = []
-    for tree in document:
-        result += _calculate_average_children(tree)
-    return np.average(result)
-
+def _get_tree_counts(tree: AnyTree) -> TreeCounts:
+    """
+    Count the basic properties of a tree in a single traversal.
 
-def _get_average_inner_to_leaf_ratio(document: List[nltk.Tree]) -> float:
-    result = []
-    for tree in document:
-        num_leaves = len(tree.leaves())
-        num_total = len(tree.treepositions()) - 1  # root node
-        result.append(num_leaves / num_total)
-    return np.average(result)
+    Returns:
+        the height of the tree (as defined by nltk.Tree.height), the number of
+        nodes including leaves, the number of leaves and the maximum number of
+        children of any node.
+    """
+    if isinstance(tree, ArrayTree):
+        return (
+            tree.height(),
+            len(tree),
+            int(np.count_nonzero(tree.is_leaf)),
+            int(tree.get_child_counts().max()),
+        )
+    return _counts_from_nodes(_iter_nodes(tree))
 
 
-def _get_max_tree_width(tree: nltk.Tree) -> int:
-    maximum = 0
-    if type(tree) == nltk.tree.Tree:
-        for child in tree:
-            maximum = max(maximum, _get_max_tree_width(child), len(tree))
-    return maximum
+def _counts_from_nodes(nodes: Iterable[Node]) -> TreeCounts:
+    """Count the properties of _get_tree_counts from the nodes of a tree."""
+    max_depth, num_nodes, num_leaves, max_width = 0, 0, 0, 0
+    for depth, _, is_leaf, num_children in nodes:
+        num_nodes += 1
+        max_depth = max(max_depth, depth)
+        max_width = max(max_width, num_children)
+        num_leaves += is_leaf
+    return max_depth + 1, num_nodes, num_leaves, max_width
 
 
-def _get_max_child_width(document: List[nltk.Tree]) -> float:
-    result = []
-    for tree in document:
-        result.append(_get_max_tree_width(tree))
-    return np.average(result)
+def _aggregate_tree_counts(tree_counts: List[TreeCounts]) -> List[float]:
+    """Calculate the features of TreeStatsVectorizer from the trees' counts."""
+    counts = np.array(tree_counts, dtype=float).reshape(-1, 4)
+    heights, num_nodes, num_leaves, max_widths = counts.T
+    # every node but the root is the child of another node
+    num_children = num_nodes - 1
+    ratios = np.divide(
+        num_leaves,
+        num_children,
+        out=np.zeros_like(num_leaves),
+        where=num_children != 0,
+    )
+    return [
+        np.mean(heights),
+        np.sum(num_children) / np.sum(num_nodes),
+        np.mean(ratios),
+        np.mean(max_widths),
+    ]
 
 
 class TreeStatsVectorizer(TransformerMixin, BaseEstimator):
@@ -232,48 +880,184 @@ class TreeStatsVectorizer(TransformerMixin, BaseEstimator):
     This transformer creates aggregated high-level features that are not
     dependent on the content of the tree.
 
-    input: list of list of trees
-    output: list of list of numbers/floats
+    Each document is described by:
+     - the average height of its trees
+     - the average number of children of all nodes (including leaves)
+     - the average ratio of leaves to non-root nodes of its trees
+     - the average of the maximum number of children in each tree
+
+    input: list of list of trees (nltk.Tree or ArrayTree)
+    output: a matrix with one row of four features per document
     """
 
     def fit(self, _x: Any, _y: Any = None) -> TreeStatsVectorizer:
         """Fit the model."""
         return self
 
-    def transform(self, x: List[List[nltk.Tree]], _y: Any = None) -> List[List[float]]:
+    def transform(self, x: List[List[AnyTree]], _y: Any = None) -> np.ndarray:
         """Transform the data."""
-        result = []
-        for document in x:
-            result.append(
-                [
-                    _get_average_height(document),
-                    _get_average_children(document),
-                    _get_average_inner_to_leaf_ratio(document),
-                    _get_max_child_width(document),
-                ]
+        result = np.empty((len(x), 4))
+        for i, document in enumerate(x):
+            result[i] = _aggregate_tree_counts(
+                [_get_tree_counts(tree) for tree in document]
             )
         return result
 
 
+TREE_VIEWS = ["pos", "chains", "stats"]
+
+
+class TreeMultiViewTransformer(BaseEstimator, TransformerMixin):
+    """
+    Calculate several views of the same trees in a single traversal.
+
+    The views are:
+     - "pos": the output of WordToPosTransformer
+     - "chains": the output of a TreeChainTransformer
+     - "stats": the output of TreeStatsVectorizer
+
+    Using those transformers in separate branches of a FeatureUnion traverses
+    each tree once per branch. Instead, this transformer can be placed in
+    front of the FeatureUnion, where each branch selects its view using a
+    TreeViewSelector, e.g.:
+
+        make_pipeline(
+            TreeMultiViewTransformer(["pos", "stats"]),
+            make_union(
+                make_pipeline(TreeViewSelector("pos"), <some vectorizer>),
+                TreeViewSelector("stats"),
+            ),
+        )
+
+    input: list of list of trees (nltk.Tree or ArrayTree)
+    output: a dict mapping each requested view to its output.
+    """
+
+    def __init__(
+        self,
+        views: List[str] = None,
+        chain_transformer: TreeChainTransformer = None,
+    ):
+        """
+        Initialize the transformer.
+
+        Args:
+            views: which views to calculate. Defaults to all views.
+            chain_transformer: the transformer whose parameters (maximum
+                length, output format) are used to produce the "chains" view.
+                Defaults to TreeChainTransformer().
+        """
+        if views is not None:
+            unknown = [view for view in views if view not in TREE_VIEWS]
+            if unknown:
+                raise ValueError(
+                    f"unknown views: {unknown}. valid values: {TREE_VIEWS}"
+                )
+        self.views = views
+        self.chain_transformer = chain_transformer
+
+    def fit(self, _x: Any, _y: Any = None) -> TreeMultiViewTransformer:
+        """Fit the model."""
+        return self
+
+    def transform(self, x: List[List[AnyTree]], _y: Any = None) -> Dict[str, Any]:
+        """Transform the data."""
+        views = self.views or TREE_VIEWS
+        chain_transformer = self.chain_transformer or TreeChainTransformer()
+        pos: List[List[str]] = []
+        stats = np.empty((len(x), 4))
+
+        def walk() -> Iterator[List[Iterable[List[str]]]]:
+            # pos and stats are collected while the chains are consumed, so
+            # that only the nodes of one document are held at a time.
+            for i, document in enumerate(x):
+                tags: List[str] = []
+                counts = []
+                chains: List[Iterable[List[str]]] = []
+                for tree in document:
+                    nodes = list(_iter_nodes(tree))
+                    if "pos" in views:
+                        tags += _pos_from_nodes(nodes)
+                    if "stats" in views:
+                        counts.append(_counts_from_nodes(nodes))
+                    if "chains" in views:
+                        chains.append(chain_transformer._chains_from_nodes(nodes))
+                pos.append(tags)
+                if "stats" in views:
+                    stats[i] = _aggregate_tree_counts(counts)
+                yield chains
+
+        result: Dict[str, Any] = {}
+        if "chains" in views:
+            result["chains"] = chain_transformer._combine(walk())
+        else:
+            for _ in walk():
+                pass
+        if "pos" in views:
+            result["pos"] = pos
+        if "stats" in views:
+            result["stats"] = stats
+        return result
+
+
+class TreeViewSelector(BaseEstimator, TransformerMixin):
+    """
+    Select a single view from the output of TreeMultiViewTransformer.
+
+    input: a dict mapping views to their output
+    output: the output of the selected view
+    """
+
+    def __init__(self, view: str):
+        """
+        Initialize the transformer.
+
+        Args:
+            view: the name of the view to select, e.g. "pos".
+        """
+        self.view = view
+
+    def fit(self, _x: Any, _y: Any = None) -> TreeViewSelector:
+        """Fit the model."""
+        return self
+
+    def transform(self, x: Dict[str, Any], _y: Any = None) -> Any:
+        """Transform the data."""
+        return x[self.view]
+
+
 class TreeToStringTransformer(BaseEstimator, TransformerMixin):
     """
     Transforms nltk trees into strings that can be parsed later.
 
-    input: list of list of trees
-    output: list of list of strings
+    input: list of list of trees (nltk.Tree or ArrayTree)
+    output: list of list of strings (or bytes)
     """
 
+    def __init__(self, binary: bool = False):
+        """
+        Initialize the transformer.
+
+        Args:
+            binary: if true, produce the binary representation of
+                tree_to_bytes instead of bracketed strings.
+        """
+        self.binary = binary
+
     def fit(self, _x: Any, _y: Any = None) -> TreeToStringTransformer:
         """Fit the model."""
         return self
 
-    def transform(self, x: List[List[nltk.Tree]], _y: Any = None) -> List[List[str]]:
+    def transform(
+        self, x: List[List[AnyTree]], _y: Any = None
+    ) -> List[List[Union[str, bytes]]]:
         """Transform the data."""
+        serialize = tree_to_bytes if self.binary else tree_to_string
         ret = []
         for document in x:
-            doc = []
+            doc: List[Union[str, bytes]] = []
             for tree in document:
-                doc.append(tree.pformat(margin=1000000))
+                doc.append(serialize(tree))
             ret.append(doc)
         return ret
 
@@ -282,8 +1066,8 @@ class TreeToFlatStringTransformer(TransformerMixin, BaseEstimator):
     """
     Transforms NLTK trees into Strings by traversing the tree post-order.
 
-    Input: Every document is a list of NLTK trees, one representing each
-        sentence.
+    Input: Every document is a list of NLTK trees (or ArrayTrees), one
+        representing each sentence.
     Output: Every document is a single string.
     """
 
@@ -291,16 +1075,150 @@ class TreeToFlatStringTransformer(TransformerMixin, BaseEstimator):
         """Fit the model."""
         return self
 
-    def parse(self, tree: nltk.Tree) -> str:
+    def parse(self, tree: AnyTree) -> str:
         """Convert a string to a NLTK tree."""
-        result = [tree.label()]
-        result += [self.parse(child) for child in tree]
-        return " ".join(result)
+        if isinstance(tree, ArrayTree):
+            # the labels of an array tree are already stored in pre-order
+            return " ".join(tree.get_labels())
+        return " ".join([_format_label(label) for _, label, _, _ in _iter_nodes(tree)])
 
-    def transform(self, documents: List[List[nltk.Tree]]) -> List[str]:
+    def transform(self, documents: List[List[AnyTree]]) -> List[str]:
         """Transform the data."""
         result = []
         for document in documents:
             parses = [self.parse(sentence) for sentence in document]
             result.append(". ".join(parses))
         return result
+
+
+def _iter_sentence_nodes(sentence: Any, attribute: str) -> Iterator[Node]:
+    """
+    Iterate over the dependency tree of a stanza sentence in pre-order.
+
+    The words are labeled with the given attribute (e.g., upos) and hang
+    below an artificial root node, like the trees of
+    tuhlbox.stanza.StanzaToNltkTreesTransformer. Only the head attribute of
+    each word is used, so stanza doesn't have to be imported here.
+    """
+    words = sentence.words
+    # children[i] are the positions of the dependents of word i (0 is the root)
+    children: List[List[int]] = [[] for _ in range(len(words) + 1)]
+    for position, word in enumerate(words, start=1):
+        children[word.head or 0].append(position)
+    yield 0, "root", False, len(children[0])
+    stack = [(position, 1) for position in reversed(children[0])]
+    while stack:
+        position, depth = stack.pop()
+        label = getattr(words[position - 1], attribute, None)
+        yield depth, "_" if label is None else label, False, len(children[position])
+        stack.extend((child, depth + 1) for child in reversed(children[position]))
+
+
+class PqGramTransformer(BaseEstimator, TransformerMixin):
+    """
+    Extract the pq-grams of trees, as defined by Augsten et al. 2010.
+
+    A pq-gram consists of a stem of p labels (a node and its ancestors) and a
+    base of q labels (consecutive children of the node), where missing
+    labels are padded with "*". The pq-grams are collected without
+    recursion: the stem of each node is shifted from the stem of its parent,
+    and the base register of each parent is shifted once per child.
+
+    input document: list of nltk.Tree or ArrayTree objects, or stanza
+    sentences (or a stanza Document), one for each sentence.
+
+    output document: a Counter mapping each (hashed) pq-gram to the number of
+    its occurrences in all trees of the document. This can be passed to
+    tuhlbox.stringkernels.pqgram_kernel directly.
+    """
+
+    def __init__(
+        self,
+        p: int = 2,
+        q: int = 3,
+        n_features: int = None,
+        word_attribute: str = "upos",
+    ):
+        """
+        Initialize the transformer.
+
+        Args:
+            p: the number of labels in the stem of each pq-gram.
+            q: the number of labels in the base of each pq-gram.
+            n_features: if set, the hashes are taken modulo n_features, so
+                they can be used as column indices. Otherwise, they are
+                unsigned 32 bit integers.
+            word_attribute: the word attribute used as label when stanza
+                sentences are passed.
+        """
+        if p < 1 or q < 1:
+            raise ValueError(f"p and q must be positive, got p={p} and q={q}")
+        if n_features is not None and n_features < 1:
+            raise ValueError(f"n_features must be positive, got {n_features}")
+        self.p = p
+        self.q = q
+        self.n_features = n_features
+        self.word_attribute = word_attribute
+
+    def fit(self, _x: Any, _y: Any = None) -> PqGramTransformer:
+        """Fit the model."""
+        return self
+
+    def _find_pqgrams(self, nodes: Iterable[Node]) -> Iterator[Tuple[Any, ...]]:
+        """Yield the pq-grams of a tree as tuples, given its nodes in pre-order."""
+        empty_stem = ("*",) * self.p
+        empty_base = ("*",) * self.q
+        # one [stem, base, remaining children] entry per ancestor of the node
+        stack: List[List[Any]] = []
+        for depth, label, _, num_children in nodes:
+            del stack[depth:]
+            if stack:
+                parent = stack[-1]
+                stem = parent[0][1:] + (label,)
+                parent[1] = base = parent[1][1:] + (label,)
+                yield parent[0] + base
+                parent[2] -= 1
+                if parent[2] == 0:
+                    # shift the padding into the base of a finished parent
+                    for _ in range(self.q - 1):
+                        base = base[1:] + ("*",)
+                        yield parent[0] + base
+            else:
+                stem = empty_stem[1:] + (label,)
+            if num_children:
+                stack.append([stem, empty_base, num_children])
+            else:
+                yield stem + empty_base
+
+    def _iter_trees(self, document: Any) -> Iterator[Iterator[Node]]:
+        """Yield the nodes of each tree or stanza sentence of a document."""
+        if hasattr(document, "sentences"):
+            document = document.sentences
+        for tree in document:
+            if isinstance(tree, (nltk.Tree, ArrayTree)):
+                yield _iter_nodes(tree)
+            else:
+                yield _iter_sentence_nodes(tree, self.word_attribute)
+
+    def transform(self, documents: Iterable[Any], _y: Any = None) -> List[Counter]:
+        """Transform the data."""
+        n_features = self.n_features
+        # pq-grams repeat a lot, so each distinct one is only hashed once
+        hashes: Dict[Tuple[Any, ...], int] = {}
+        result = []
+        for document in documents:
+            pqgrams: Counter = Counter()
+            for nodes in self._iter_trees(document):
+                pqgrams.update(self._find_pqgrams(nodes))
+            counter: Counter = Counter()
+            for pqgram, count in pqgrams.items():
+                value = hashes.get(pqgram)
+                if value is None:
+                    key = "\x1f".join(_format_label(label) for label in pqgram)
+                    value = murmurhash3_32(key, positive=True)
+                    if n_features is not None:
+                        value %= n_features
+                    hashes[pqgram] = value
+                counter[value] += count
+            result.append(counter)
+        return result